@@ -0,0 +1,45 @@
+"""Compare the fixed-width timestamp decoder with the strptime path.
+
+Run with ``python benchmarks/bench_datetime.py``.
+"""
+import datetime
+import timeit
+
+from iclockhelper import models
+
+_BASE = datetime.datetime(2000, 1, 1)
+_NUMBER = 100000
+
+
+def _stamps(unique: int) -> list:
+    return [
+        (_BASE + datetime.timedelta(seconds=i % unique)).strftime(
+            models.DATETIME_FORMAT)
+        for i in range(_NUMBER)
+    ]
+
+
+def _strptime(value: str):
+    try:
+        return datetime.datetime.strptime(value, models.DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _run(name: str, func, stamps: list) -> None:
+    seconds = timeit.timeit(lambda: [func(s) for s in stamps], number=1)
+    print('{:<32s}{:>10.1f} ns/op'.format(name, seconds / len(stamps) * 1e9))
+
+
+def main() -> None:
+    for unique in (_NUMBER, 100):
+        stamps = _stamps(unique)
+        print('{:d} records, {:d} unique timestamps'.format(len(stamps), unique))
+        _run('strptime', _strptime, stamps)
+        _run('fixed width', models._parse_datetime_uncached, stamps)
+        models.configure_datetime_cache()
+        _run('fixed width + lru cache', models._parse_datetime, stamps)
+
+
+if __name__ == '__main__':
+    main()
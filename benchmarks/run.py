@@ -0,0 +1,202 @@
+"""Benchmark every parser entry point on synthetic device uploads.
+
+Run with ``python benchmarks/run.py --output before.json`` and compare two
+runs with ``python benchmarks/run.py --compare before.json --output after.json``.
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import typing
+from urllib.parse import urlencode
+from urllib.request import Request
+
+import iclockhelper
+from iclockhelper.models import (
+    DATETIME_FORMAT,
+    AttendanceLog,
+    AttendancePhotoLog,
+    OperationLog,
+    TableEnum
+)
+from iclockhelper.requests import CdataRequest, GetRequest
+
+DEFAULT_SIZES = (1, 1000, 100000, 1000000)
+_HOST = 'http://localhost'
+_SN = 'BENCH0001'
+_PINS = 500
+_BASE = datetime.datetime(2020, 1, 1, 8, 0, 0)
+
+
+def attlog_body(lines: int) -> bytes:
+    return '\n'.join(
+        '{:d}\t{:s}\t{:d}\t1\t0\t0'.format(
+            i % _PINS,
+            (_BASE + datetime.timedelta(seconds=i * 7)).strftime(DATETIME_FORMAT),
+            i % 2,
+        ) for i in range(lines)
+    ).encode('ascii')
+
+
+def operlog_body(lines: int) -> bytes:
+    # roughly what a full user sync looks like: users, their fingerprints and
+    # the operation log entries around them
+    out = []
+    for i in range(lines):
+        kind = i % 4
+        pin = i % _PINS
+        if kind == 0:
+            out.append('USER PIN={:d}\tName=用户{:d}\tPri=0\tPasswd=\tCard=[{:08d}]'
+                       '\tGrp=1\tTZ=0000000100000000\tVerify=0\tViceCard='.format(
+                           pin, pin, pin))
+        elif kind == 1:
+            out.append('FP PIN={:d}\tFID={:d}\tSize=1024\tValid=1\tTMP={:s}'.format(
+                pin, i % 10, 'A' * 256))
+        else:
+            out.append('OPLOG {:d}\t0\t{:s}\t{:d}\t0\t0\t0'.format(
+                i % 30,
+                (_BASE + datetime.timedelta(seconds=i)).strftime(DATETIME_FORMAT),
+                pin,
+            ))
+    return '\n'.join(out).encode('gb18030')
+
+
+def attphoto_body(lines: int) -> typing.Tuple[str, bytes]:
+    # one base64 photo per upload, `lines` scales the payload in 100 byte steps
+    pin = '{:s}-1.jpg'.format(_BASE.strftime('%Y%m%d%H%M%S'))
+    body = 'PIN={:s}\nSN={:s}\nsize={:d}\nCMD=uploadphoto'.format(
+        pin, _SN, lines * 100).encode('ascii')
+    return pin, body + b'/9j/' * (lines * 25)
+
+
+def _request(path: str, query: typing.Dict[str, str], body: bytes = b'') -> Request:
+    query = dict(query, SN=_SN)
+    url = '{:s}{:s}?{:s}'.format(_HOST, path, urlencode(query))
+    return Request(url, body or None)
+
+
+_Case = typing.Tuple[str, typing.Callable[[], typing.Any]]
+
+
+def _cases(size: int) -> typing.List[_Case]:
+    att = attlog_body(size)
+    att_text = att.decode('ascii')
+    oper = operlog_body(size)
+    oper_text = oper.decode('gb18030')
+    photo_pin, photo = attphoto_body(size)
+    photo_text = photo.decode('ascii')
+    att_req = _request('/iclock/cdata', {'table': TableEnum.attlog.value,
+                                         'Stamp': '1'}, att)
+    oper_req = _request('/iclock/cdata', {'table': TableEnum.operlog.value,
+                                          'OpStamp': '1'}, oper)
+    photo_req = _request('/iclock/cdata', {'table': TableEnum.attphoto.value,
+                                           'Stamp': '1'}, photo)
+    # heartbeats don't have a body, `size` of them are parsed per run
+    heartbeats = [
+        _request('/iclock/getrequest', {'INFO': '2.4.1,{:d},{:d},{:d},10.0.0.1'.format(
+            i % _PINS, i % 10, i)})
+        for i in range(min(size, 100000))
+    ]
+    heartbeat_queries = [r.get_full_url().split('?', 1)[1] for r in heartbeats]
+    return [
+        ('AttendanceLog.from_str', lambda: AttendanceLog.from_str(att_text)),
+        ('AttendanceLog.from_str[columnar]',
+         lambda: AttendanceLog.from_str(att_text, columnar=True)),
+        ('AttendanceLog.from_bytes', lambda: AttendanceLog.from_bytes(att)),
+        ('OperationLog.from_str', lambda: OperationLog.from_str(oper_text)),
+        ('OperationLog.from_bytes', lambda: OperationLog.from_bytes(oper)),
+        ('AttendancePhotoLog.from_request_pin',
+         lambda: AttendancePhotoLog.from_request_pin(photo_pin, photo_text)),
+        ('AttendancePhotoLog.from_bytes',
+         lambda: AttendancePhotoLog.from_bytes(photo_pin, photo)),
+        ('CdataRequest.from_req[ATTLOG]', lambda: CdataRequest.from_req(att_req)),
+        ('CdataRequest.from_req[OPERLOG]', lambda: CdataRequest.from_req(oper_req)),
+        ('CdataRequest.from_req[ATTPHOTO]',
+         lambda: CdataRequest.from_req(photo_req)),
+        ('GetRequest.from_req', lambda: [GetRequest.from_req(r) for r in heartbeats]),
+        ('GetRequest.from_parts',
+         lambda: [GetRequest.from_parts('GET', q) for q in heartbeat_queries]),
+    ]
+
+
+def _measure(func: typing.Callable[[], typing.Any], repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'seconds': min(timings), 'peak_bytes': peak}
+
+
+def run(sizes: typing.Sequence[int], repeat: int,
+        only: typing.Optional[str] = None) -> dict:
+    results = []
+    for size in sizes:
+        for name, func in _cases(size):
+            if only and only not in name:
+                continue
+            result = dict(name=name, size=size, **_measure(func, repeat))
+            results.append(result)
+            print('{:<40s}{:>9d}{:>12.4f} s{:>14d} B'.format(
+                name, size, result['seconds'], result['peak_bytes']),
+                file=sys.stderr)
+    return {
+        'version': iclockhelper.__version__,
+        'python': platform.python_version(),
+        'date': datetime.datetime.now().isoformat(),
+        'results': results,
+    }
+
+
+def compare(before: dict, after: dict) -> None:
+    old = {(r['name'], r['size']): r for r in before['results']}
+    print('{:<40s}{:>9s}{:>10s}{:>10s}'.format('case', 'size', 'time', 'memory'))
+    for r in after['results']:
+        prev = old.get((r['name'], r['size']))
+        if prev is None:
+            continue
+        print('{:<40s}{:>9d}{:>9.2f}x{:>9.2f}x'.format(
+            r['name'], r['size'],
+            r['seconds'] / prev['seconds'] if prev['seconds'] else 0.0,
+            r['peak_bytes'] / prev['peak_bytes'] if prev['peak_bytes'] else 0.0,
+        ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated line counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='run cases whose name contains this')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    report = run([int(s) for s in args.sizes.split(',')], args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
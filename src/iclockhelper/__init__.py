@@ -1,13 +1,94 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
-from .models import *  # noqa
-from .requests import *  # noqa
-
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = __name__
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = 'unknown'
-finally:
-    del get_distribution, DistributionNotFound
+import importlib
+import typing
+
+# exported names are imported on first access, so `import iclockhelper` stays
+# cheap for short lived processes
+_EXPORTS = {
+    'UNKNOWN': 'models',
+    'DATETIME_FORMAT': 'models',
+    'DATETIME_CACHE_SIZE': 'models',
+    'DEFAULT_INTERN_SIZE': 'models',
+    'NO_EPOCH': 'models',
+    'UnknowableEnum': 'models',
+    'TableEnum': 'models',
+    'AlarmEnum': 'models',
+    'OperationEnum': 'models',
+    'InternTable': 'models',
+    'ServerDatetimeMixin': 'models',
+    'Transaction': 'models',
+    'User': 'models',
+    'Fingerprint': 'models',
+    'Operation': 'models',
+    'OperationLog': 'models',
+    'StringColumn': 'models',
+    'TransactionColumns': 'models',
+    'AttendanceLog': 'models',
+    'AttendancePhotoLog': 'models',
+    'CommandReturn': 'models',
+    'configure_datetime_cache': 'models',
+    'TIMEZONE_CACHE_SIZE': 'models',
+    'DeviceTimezone': 'models',
+    'device_timezone': 'models',
+    'Info': 'requests',
+    'ZKRequest': 'requests',
+    'GetRequest': 'requests',
+    'DeviceCmdRequest': 'requests',
+    'CdataRequest': 'requests',
+    'EncodingStrategy': 'requests',
+    'default_encoding_strategy': 'requests',
+    'DeviceInternTables': 'requests',
+    'INFO_CACHE_SIZE': 'requests',
+    'configure_info_cache': 'requests',
+    'parse_many': 'batch',
+}
+
+__all__ = sorted(_EXPORTS) + ['Request', '__version__']
+
+# `iclockhelper.models` etc. worked without importing them while the package
+# star-imported its modules
+_SUBMODULES = frozenset((
+    'adapters', 'analytics', 'batch', 'commands', 'export', 'journal', 'metrics',
+    'models', 'requests', 'server', 'store', 'sync'))
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name in _EXPORTS:
+        # __import__ rather than importlib.import_module, which -X importtime
+        # doesn't report
+        value = getattr(
+            __import__(_EXPORTS[name], globals(), None, [name], 1), name)
+    elif name == 'Request':
+        # kept for the README's create_request()
+        from urllib.request import Request as value
+    elif name == '__version__':
+        value = _version()
+    elif name in _SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+def _version() -> str:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # python 3.7
+        try:
+            from importlib_metadata import (  # type: ignore
+                PackageNotFoundError,
+                version
+            )
+        except ImportError:
+            return 'unknown'
+    try:
+        # Change here if project is renamed and does not equal the package name
+        return version(__name__)
+    except PackageNotFoundError:
+        return 'unknown'
@@ -0,0 +1,76 @@
+import typing
+
+from .requests import CdataRequest, DeviceCmdRequest, GetRequest, ZKRequest
+
+# last path segment, so the endpoints also work below a mount point
+_ENDPOINTS = {
+    'cdata': CdataRequest,
+    'getrequest': GetRequest,
+    'devicecmd': DeviceCmdRequest,
+}  # type: typing.Dict[str, typing.Any]
+
+
+def from_parts(
+        method: str,
+        path: str,
+        query_string: str,
+        body: bytes = b'',
+        **kwargs: typing.Any,
+) -> typing.Optional[ZKRequest]:
+    # kwargs go to CdataRequest.from_parts, None for an unknown path
+    endpoint = _ENDPOINTS.get(path.rstrip('/').rsplit('/', 1)[-1])
+    if endpoint is None:
+        return None
+    if endpoint is CdataRequest:
+        return CdataRequest.from_parts(method, query_string, body, **kwargs)
+    return endpoint.from_parts(method, query_string, body)
+
+
+def from_wsgi(
+        environ: typing.Mapping[str, typing.Any],
+        **kwargs: typing.Any,
+) -> typing.Optional[ZKRequest]:
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    stream = environ.get('wsgi.input')
+    body = b''
+    if stream is not None:
+        if length > 0:
+            body = stream.read(length)
+        elif environ.get('wsgi.input_terminated'):
+            body = stream.read()
+    return from_parts(
+        environ.get('REQUEST_METHOD', 'GET'),
+        environ.get('PATH_INFO', ''),
+        environ.get('QUERY_STRING', ''),
+        body,
+        **kwargs
+    )
+
+
+def from_asgi(
+        scope: typing.Mapping[str, typing.Any],
+        body: bytes = b'',
+        **kwargs: typing.Any,
+) -> typing.Optional[ZKRequest]:
+    # the body is read by the caller, see read_asgi_body
+    return from_parts(
+        scope.get('method', 'GET'),
+        scope.get('path', ''),
+        scope.get('query_string', b'').decode('latin-1'),
+        body,
+        **kwargs
+    )
+
+
+async def read_asgi_body(
+        receive: typing.Callable[[], typing.Awaitable[typing.Mapping[str, typing.Any]]],
+) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
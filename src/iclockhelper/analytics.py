@@ -0,0 +1,140 @@
+import datetime
+import typing
+
+import dataclasses as da
+
+from .models import (
+    NO_EPOCH,
+    AttendanceLog,
+    Transaction,
+    TransactionColumns,
+    _decode
+)
+
+try:
+    import numpy as np
+except ImportError as e:  # pragma: no cover
+    raise ImportError(
+        'iclockhelper.analytics needs numpy: pip install iclockhelper[analytics]'
+    ) from e
+
+_DAY = 24 * 60 * 60
+
+_Source = typing.Union[
+    AttendanceLog, TransactionColumns, typing.Iterable[Transaction], str, bytes]
+
+
+@da.dataclass(frozen=True)
+class PunchArrays:
+    # one row per transaction with a valid datetime, pins[i] indexes pin_values
+    pins: 'np.ndarray'
+    timestamps: 'np.ndarray'  # datetime64[s], device local time
+    pin_values: typing.List[str]
+
+    def __len__(self) -> int:
+        return len(self.pins)
+
+
+@da.dataclass(frozen=True)
+class DailySummary:
+    # one row per pin and day, sorted by pin code and day
+    pins: 'np.ndarray'
+    days: 'np.ndarray'  # datetime64[D]
+    first_in: 'np.ndarray'  # datetime64[s]
+    last_out: 'np.ndarray'  # datetime64[s]
+    punches: 'np.ndarray'
+    pin_values: typing.List[str]
+
+    @property
+    def worked(self) -> 'np.ndarray':
+        return self.last_out - self.first_in
+
+    def __len__(self) -> int:
+        return len(self.pins)
+
+    def rows(self) -> typing.Iterator[typing.Tuple[
+            str, datetime.date, datetime.datetime, datetime.datetime,
+            datetime.timedelta, int]]:
+        pin_values = self.pin_values
+        for pin, day, first, last, worked, punches in zip(
+                self.pins.tolist(), self.days.tolist(), self.first_in.tolist(),
+                self.last_out.tolist(), self.worked.tolist(), self.punches.tolist()):
+            yield pin_values[pin], day, first, last, worked, punches
+
+
+def to_arrays(
+        source: _Source,
+        encoding: typing.Optional[str] = None,
+) -> PunchArrays:
+    # `encoding` of bytes, detected when not given
+    if isinstance(source, bytes):
+        source = _decode(source, encoding)
+    if isinstance(source, str):
+        source = TransactionColumns.from_str(source)
+    if isinstance(source, AttendanceLog):
+        source = source.transactions
+    if isinstance(source, TransactionColumns):
+        # the columns already hold pin codes and epoch seconds
+        pins = np.array(source.pins.codes, dtype=np.int64)
+        epochs = np.array(source.epoch_seconds, dtype=np.int64)
+        pin_values = list(source.pins.values)
+    else:
+        codes = {}  # type: typing.Dict[str, int]
+        pin_codes = []
+        datetimes = []
+        for transaction in source:
+            pin_codes.append(codes.setdefault(transaction.pin, len(codes)))
+            datetimes.append(transaction.server_datetime)
+        pins = np.array(pin_codes, dtype=np.int64)
+        epochs = np.array(datetimes, dtype='datetime64[s]').view(np.int64)
+        pin_values = list(codes)
+    # NaT and NO_EPOCH are the same int64
+    valid = epochs != NO_EPOCH
+    if not valid.all():
+        pins, epochs = pins[valid], epochs[valid]
+    return PunchArrays(
+        pins=pins,
+        timestamps=epochs.astype('datetime64[s]'),
+        pin_values=pin_values,
+    )
+
+
+def daily_summary(
+        source: typing.Union[PunchArrays, _Source],
+        shift: datetime.timedelta = datetime.timedelta(0),
+        day_start: datetime.timedelta = datetime.timedelta(0),
+) -> DailySummary:
+    # `shift` moves device time to another zone first, like correct_datetime
+    # with a fixed offset; `day_start` counts punches before it to the day
+    # before, for night shifts
+    arrays = source if isinstance(source, PunchArrays) else to_arrays(source)
+    seconds = arrays.timestamps.view(np.int64) + int(shift.total_seconds())
+    since_day_start = seconds - int(day_start.total_seconds())
+    days = since_day_start // _DAY
+    pin_values = arrays.pin_values
+    if not len(seconds):
+        empty = np.array([], dtype=np.int64)
+        return DailySummary(
+            pins=empty, days=empty.astype('datetime64[D]'),
+            first_in=empty.astype('datetime64[s]'),
+            last_out=empty.astype('datetime64[s]'), punches=empty,
+            pin_values=pin_values)
+
+    # one int64 sort key: pin, then day, then time of day
+    first_day = days.min()
+    day_count = days.max() - first_day + 1
+    group = arrays.pins * day_count + (days - first_day)
+    order = np.argsort(group * _DAY + (since_day_start - days * _DAY))
+    group = group[order]
+    seconds = seconds[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1])))
+    ends = np.concatenate((starts[1:], [len(group)]))
+    return DailySummary(
+        pins=group[starts] // day_count,
+        days=(group[starts] % day_count + first_day).astype('datetime64[D]'),
+        first_in=seconds[starts].astype('datetime64[s]'),
+        last_out=seconds[ends - 1].astype('datetime64[s]'),
+        punches=ends - starts,
+        pin_values=pin_values,
+    )
@@ -0,0 +1,51 @@
+import concurrent.futures
+import functools
+import typing
+from urllib.request import Request
+
+import dataclasses as da
+
+from .requests import CdataRequest
+
+# a urllib Request or an archived (url, body) pair, an empty body means GET
+RawRequest = typing.Union[Request, typing.Tuple[str, bytes]]
+
+_Job = typing.Tuple[str, str, bytes]
+
+
+def parse_many(
+        requests: typing.Iterable[RawRequest],
+        workers: typing.Optional[int] = None,
+        chunksize: int = 64,
+        keep_raw: bool = False,
+) -> typing.List[CdataRequest]:
+    jobs = [_to_job(req) for req in requests]
+    parse = functools.partial(_parse_job, keep_raw=keep_raw)
+    if workers == 1 or len(jobs) <= 1:
+        return [parse(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse, jobs, chunksize=chunksize))
+
+
+def _to_job(req: RawRequest) -> _Job:
+    # only plain tuples cross the process boundary
+    if isinstance(req, Request):
+        data = typing.cast(bytes, req.data)
+        return req.get_method(), req.get_full_url(), data or b''
+    url, body = req
+    return 'POST' if body else 'GET', url, body or b''
+
+
+def _parse_job(job: _Job, keep_raw: bool) -> CdataRequest:
+    method, url, body = job
+    cdata_req = CdataRequest.from_req(
+        Request(url, data=body or None, method=method),
+        keep_raw=keep_raw,
+        lazy=not keep_raw,
+    )
+    if not keep_raw:
+        # the decoded body would be the largest part of the pickled result:
+        # replace() parses the logs from the bytes without ever decoding it
+        # and leaves the unparsed payload behind
+        cdata_req = da.replace(cdata_req, body='')
+    return cdata_req
@@ -0,0 +1,102 @@
+import collections
+import itertools
+import typing
+
+import dataclasses as da
+
+from .models import CommandReturn
+from .requests import DeviceCmdRequest
+
+# devices read the getrequest reply into a fixed buffer
+DEFAULT_MAX_RESPONSE_SIZE = 16 * 1024
+
+
+@da.dataclass(frozen=True)
+class Command:
+    id: int
+    sn: str
+    cmd: str
+
+    def to_line(self) -> str:
+        return 'C:{:d}:{:s}\n'.format(self.id, self.cmd)
+
+
+class CommandQueue:
+    def __init__(
+            self,
+            max_response_size: int = DEFAULT_MAX_RESPONSE_SIZE,
+            encoding: str = 'utf-8',
+            first_id: int = 1,
+    ) -> None:
+        self.max_response_size = max_response_size
+        self.encoding = encoding
+        self._ids = itertools.count(first_id)
+        self._pending = collections.defaultdict(
+            collections.deque)  # type: typing.DefaultDict[str, typing.Deque[Command]]
+        self._sent = {}  # type: typing.Dict[int, Command]
+
+    def push(self, sn: str, cmd: str) -> Command:
+        command = Command(id=next(self._ids), sn=sn, cmd=cmd)
+        self._pending[sn].append(command)
+        return command
+
+    def push_many(
+            self,
+            sns: typing.Iterable[str],
+            cmds: typing.Iterable[str],
+    ) -> typing.List[Command]:
+        cmds = list(cmds)
+        return [self.push(sn, cmd) for sn in sns for cmd in cmds]
+
+    def pending(self, sn: str) -> int:
+        return len(self._pending.get(sn, ()))
+
+    def in_flight(self, sn: typing.Optional[str] = None) -> typing.List[Command]:
+        return [c for c in self._sent.values() if sn is None or c.sn == sn]
+
+    def pack(self, sn: str, max_size: typing.Optional[int] = None) -> str:
+        # as many queued commands as fit into one getrequest reply, the first
+        # one is always sent so an oversized command can't block the queue
+        queue = self._pending.get(sn)
+        if not queue:
+            return ''
+        limit = self.max_response_size if max_size is None else max_size
+        lines = []  # type: typing.List[str]
+        size = 0
+        while queue:
+            line = queue[0].to_line()
+            line_size = len(line.encode(self.encoding))
+            if lines and size + line_size > limit:
+                break
+            command = queue.popleft()
+            self._sent[command.id] = command
+            lines.append(line)
+            size += line_size
+        if not queue:
+            del self._pending[sn]
+        return ''.join(lines)
+
+    def acknowledge(self, ret: CommandReturn) -> typing.Optional[Command]:
+        try:
+            return self._sent.pop(int(ret.id))
+        except (KeyError, ValueError):
+            return None
+
+    def acknowledge_request(
+            self,
+            req: DeviceCmdRequest,
+    ) -> typing.List[typing.Tuple[Command, CommandReturn]]:
+        acked = []
+        for ret in req.returns:
+            command = self.acknowledge(ret)
+            if command is not None:
+                acked.append((command, ret))
+        return acked
+
+    def requeue(self, sn: typing.Optional[str] = None) -> int:
+        # put unanswered commands back in front, e.g. after a device reboot
+        commands = sorted(self.in_flight(sn), key=lambda c: c.id, reverse=True)
+        for command in commands:
+            del self._sent[command.id]
+            self._pending[command.sn].appendleft(command)
+        return len(commands)
@@ -0,0 +1,149 @@
+import csv
+import datetime
+import enum
+import json
+import operator
+import typing
+
+import dataclasses as da
+
+from .models import Transaction, TransactionColumns
+
+DEFAULT_BATCH_SIZE = 1024
+
+_Converter = typing.Callable[[typing.Any], typing.Any]
+
+
+def _render_datetime(value: typing.Optional[datetime.datetime]) -> str:
+    return value.isoformat(' ') if value is not None else ''
+
+
+def _is_datetime_type(tp: typing.Any) -> bool:
+    return tp is datetime.datetime or datetime.datetime in getattr(tp, '__args__', ())
+
+
+def _is_enum_type(tp: typing.Any) -> bool:
+    return isinstance(tp, type) and issubclass(tp, enum.Enum)
+
+
+class _Plan:
+    # per record type: field names, one C-level getter and the columns that
+    # need converting; built once instead of dataclasses.asdict per record
+    def __init__(
+            self,
+            record_type: type,
+            fields: typing.Optional[typing.Sequence[str]],
+    ) -> None:
+        model_fields = {f.name: f for f in da.fields(record_type)}
+        self.names = tuple(fields) if fields is not None else tuple(model_fields)
+        getter = operator.attrgetter(*self.names)
+        if len(self.names) == 1:
+            self.get = lambda record: (getter(record),)  # type: _Converter
+        else:
+            self.get = getter
+        self.datetimes = tuple(
+            i for i, name in enumerate(self.names)
+            if _is_datetime_type(model_fields[name].type))
+        self.enums = tuple(
+            i for i, name in enumerate(self.names)
+            if _is_enum_type(model_fields[name].type))
+
+    def row(self, record: typing.Any, render_datetime: bool = True) -> typing.List:
+        values = list(self.get(record))
+        if render_datetime:
+            for i in self.datetimes:
+                values[i] = _render_datetime(values[i])
+        for i in self.enums:
+            values[i] = values[i].value
+        return values
+
+
+_plans = {}  # type: typing.Dict[typing.Tuple[type, typing.Any], _Plan]
+
+
+def _plan(
+        record_type: type,
+        fields: typing.Optional[typing.Sequence[str]] = None,
+) -> _Plan:
+    key = (record_type, tuple(fields) if fields is not None else None)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = _Plan(record_type, fields)
+    return plan
+
+
+def _batches(
+        records: typing.Iterable[typing.Any],
+        batch_size: int,
+) -> typing.Iterator[typing.List[typing.Any]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_csv(
+        records: typing.Iterable[typing.Any],
+        fileobj: typing.TextIO,
+        fields: typing.Optional[typing.Sequence[str]] = None,
+        header: bool = True,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    writer = csv.writer(fileobj)
+    plan = None  # type: typing.Optional[_Plan]
+    count = 0
+    for batch in _batches(records, batch_size):
+        if plan is None:
+            plan = _plan(type(batch[0]), fields)
+            if header:
+                writer.writerow(plan.names)
+        writer.writerows([plan.row(record) for record in batch])
+        count += len(batch)
+    return count
+
+
+def write_ndjson(
+        records: typing.Iterable[typing.Any],
+        fileobj: typing.TextIO,
+        fields: typing.Optional[typing.Sequence[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    count = 0
+    for batch in _batches(records, batch_size):
+        lines = []
+        for record in batch:
+            plan = _plan(type(record), fields)
+            lines.append(encode(dict(zip(plan.names, plan.row(record)))))
+        fileobj.write('\n'.join(lines) + '\n')
+        count += len(batch)
+    return count
+
+
+def to_columns(
+        records: typing.Iterable[typing.Any],
+        fields: typing.Optional[typing.Sequence[str]] = None,
+        render_datetime: bool = False,
+) -> typing.Dict[str, typing.List[typing.Any]]:
+    # datetimes stay datetime objects unless render_datetime, so the lists can
+    # go straight to numpy.array(..., dtype='datetime64[s]')
+    if isinstance(records, TransactionColumns):
+        names = fields or [f.name for f in da.fields(Transaction)]
+        columns = {name: records.column(name) for name in names}
+        if render_datetime and 'server_datetime' in columns:
+            columns['server_datetime'] = [
+                _render_datetime(v) for v in columns['server_datetime']]
+        return columns
+    plan = None  # type: typing.Optional[_Plan]
+    rows = []
+    for record in records:
+        if plan is None:
+            plan = _plan(type(record), fields)
+        rows.append(plan.row(record, render_datetime))
+    if plan is None:
+        return {name: [] for name in fields or ()}
+    return {name: list(column) for name, column in zip(plan.names, zip(*rows))}
@@ -0,0 +1,379 @@
+import array
+import mmap
+import os
+import struct
+import sys
+import threading
+import typing
+import zlib
+from urllib.parse import urlencode
+
+import dataclasses as da
+
+from . import adapters
+from .requests import CdataRequest, ZKRequest, _parse_query
+
+# every record is a header followed by meta and body:
+#   magic, meta length, body length, crc32 of meta + body
+# meta is 'METHOD path query_string' in latin-1, body the raw request body
+MAGIC = b'ICJ1'
+_HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = _HEADER.size
+# the side index holds one little endian uint64 offset per record
+INDEX_SUFFIX = '.idx'
+_OFFSET = 'Q'
+
+# JournalWriter fsync policies
+FSYNC_ALWAYS = 'always'  # every append is written and fsynced on its own
+# appends wait for a shared fsync: the ones arriving while a commit is in
+# flight are committed together by the next one
+FSYNC_BATCH = 'batch'
+# appends return at once, commits every commit_every records or
+# commit_interval seconds are handed to the OS, which writes them back
+FSYNC_NEVER = 'never'
+_FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_NEVER)
+
+
+class JournalError(ValueError):
+    pass
+
+
+@da.dataclass(frozen=True)
+class JournalRecord:
+    number: int
+    offset: int
+    method: str
+    path: str
+    query_string: str
+    body: bytes = da.field(repr=False)
+
+    def parse(self, **kwargs: typing.Any) -> typing.Optional[ZKRequest]:
+        # kwargs go to CdataRequest.from_parts, see adapters.from_parts
+        return adapters.from_parts(
+            self.method, self.path, self.query_string, self.body, **kwargs)
+
+
+def pack_meta(method: str, path: str, query_string: str) -> bytes:
+    return '{:s} {:s} {:s}'.format(method, path, query_string).encode('latin-1')
+
+
+def pack_record(method: str, path: str, query_string: str, body: bytes) -> bytes:
+    meta = pack_meta(method, path, query_string)
+    crc = zlib.crc32(body, zlib.crc32(meta))
+    return b''.join((_HEADER.pack(MAGIC, len(meta), len(body), crc), meta, body))
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def read_index(path: str) -> array.array:
+    offsets = array.array(_OFFSET)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return offsets
+    # a torn last entry is dropped, the reader rescans from there
+    offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets
+
+
+def _index_bytes(offsets: typing.Sequence[int]) -> bytes:
+    out = array.array(_OFFSET, offsets)
+    if sys.byteorder == 'big':
+        out.byteswap()
+    return out.tobytes()
+
+
+def build_index(path: str) -> int:
+    # (re)writes the side index of a journal, returns the record count
+    with JournalReader(path, use_index=False) as reader:
+        offsets = reader.offsets
+    tmp = index_path(path) + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_index_bytes(offsets))
+    os.replace(tmp, index_path(path))
+    return len(offsets)
+
+
+class JournalReader:
+    # memory maps the journal, bodies are copied out one record at a time
+    def __init__(
+            self,
+            path: str,
+            use_index: bool = True,
+            verify: bool = True,
+    ) -> None:
+        self.path = path
+        self.verify = verify
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses empty files
+        self._data = mmap.mmap(
+            self._file.fileno(), 0, access=mmap.ACCESS_READ
+        ) if size else b''  # type: typing.Union[mmap.mmap, bytes]
+        self.offsets = read_index(index_path(path)) if use_index else array.array(
+            _OFFSET)
+        self._scan()
+
+    def _scan(self) -> None:
+        offsets = self.offsets
+        size = len(self._data)
+        # the index may lag behind the journal or be stale, keep what matches
+        while offsets and not self._is_record(offsets[-1]):
+            offsets.pop()
+        pos = self._end(offsets[-1]) if offsets else 0
+        while pos < size:
+            end = self._end(pos)
+            if end > size:
+                # a torn write at the end, e.g. after a crash
+                break
+            offsets.append(pos)
+            pos = end
+        # end of the last complete record
+        self.end = pos
+
+    def _is_record(self, offset: int) -> bool:
+        return (offset + HEADER_SIZE <= len(self._data)
+                and _HEADER.unpack_from(self._data, offset)[0] == MAGIC
+                and self._end(offset) <= len(self._data))
+
+    def _end(self, offset: int) -> int:
+        if offset + HEADER_SIZE > len(self._data):
+            return len(self._data) + 1
+        magic, meta_len, body_len, _ = _HEADER.unpack_from(self._data, offset)
+        if magic != MAGIC:
+            raise JournalError('bad record magic at offset {:d}'.format(offset))
+        return offset + HEADER_SIZE + meta_len + body_len
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, number: int) -> JournalRecord:
+        if number < 0:
+            number += len(self.offsets)
+        return self._record(number, self.offsets[number])
+
+    def __iter__(self) -> typing.Iterator[JournalRecord]:
+        return self.records()
+
+    def records(
+            self,
+            start: int = 0,
+            sn: typing.Optional[str] = None,
+    ) -> typing.Iterator[JournalRecord]:
+        # with sn only the meta of other devices' records is read
+        offsets = self.offsets
+        for number in range(start, len(offsets)):
+            offset = offsets[number]
+            if sn is not None and self.sn(number) != sn:
+                continue
+            yield self._record(number, offset)
+
+    def sn(self, number: int) -> str:
+        query_string = self._meta(self.offsets[number])[2]
+        return _parse_query(query_string).get('SN', '')
+
+    def _meta(self, offset: int) -> typing.Tuple[str, str, str]:
+        _, meta_len, _, _ = _HEADER.unpack_from(self._data, offset)
+        start = offset + HEADER_SIZE
+        meta = self._data[start:start + meta_len].decode('latin-1')
+        method, _, rest = meta.partition(' ')
+        path, _, query_string = rest.partition(' ')
+        return method, path, query_string
+
+    def _record(self, number: int, offset: int) -> JournalRecord:
+        _, meta_len, body_len, crc = _HEADER.unpack_from(self._data, offset)
+        start = offset + HEADER_SIZE + meta_len
+        body = self._data[start:start + body_len]
+        if self.verify:
+            meta = self._data[offset + HEADER_SIZE:start]
+            if zlib.crc32(body, zlib.crc32(meta)) != crc:
+                raise JournalError(
+                    'checksum mismatch in record {:d}'.format(number))
+        method, path, query_string = self._meta(offset)
+        return JournalRecord(
+            number=number,
+            offset=offset,
+            method=method,
+            path=path,
+            query_string=query_string,
+            body=body,
+        )
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> 'JournalReader':
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+
+class JournalWriter:
+    # durability of append() depends on the fsync policy, see FSYNC_*;
+    # the side index is kept up to date with every commit
+    def __init__(
+            self,
+            path: str,
+            fsync: str = FSYNC_BATCH,
+            commit_every: int = 1000,
+            commit_interval: float = 1.0,
+    ) -> None:
+        if fsync not in _FSYNC_POLICIES:
+            raise ValueError('fsync must be one of {!r}'.format(_FSYNC_POLICIES))
+        self.path = path
+        self.fsync = fsync
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._cond = threading.Condition(threading.Lock())
+        # drop a torn last record and catch the index up before appending
+        offsets = array.array(_OFFSET)
+        end = 0
+        if os.path.exists(path):
+            with JournalReader(path, verify=False) as reader:
+                offsets, end = reader.offsets, reader.end
+            if len(read_index(index_path(path))) != len(offsets):
+                with open(index_path(path), 'wb') as f:
+                    f.write(_index_bytes(offsets))
+        self._file = open(path, 'ab')
+        self._file.truncate(end)
+        self._index = open(index_path(path), 'ab')
+        self._count = len(offsets)
+        self._end = end
+        self._buffer = bytearray()
+        self._offsets = array.array(_OFFSET)
+        # records written, a commit in flight and why the last one failed
+        self._committed = self._count
+        self._committing = False
+        self._error = None  # type: typing.Optional[Exception]
+        self._closed = threading.Event()
+        self._flusher = None  # type: typing.Optional[threading.Thread]
+        if fsync == FSYNC_NEVER:
+            # quiet periods don't leave appends in the buffer
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name='JournalWriter-flush',
+                daemon=True)
+            self._flusher.start()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(
+            self,
+            method: str,
+            path: str,
+            query_string: str,
+            body: bytes = b'',
+    ) -> int:
+        # returns the record number once the fsync policy is satisfied
+        record = pack_record(method, path, query_string, body)
+        with self._cond:
+            if self._closed.is_set():
+                raise ValueError('append to a closed JournalWriter')
+            number = self._count
+            self._offsets.append(self._end)
+            self._buffer += record
+            self._end += len(record)
+            self._count += 1
+            if self.fsync == FSYNC_ALWAYS:
+                # the lock is held, so no other append shares this fsync
+                self._write(self._take())
+                self._committed = self._count
+            elif self.fsync == FSYNC_BATCH:
+                self._group_commit(number + 1)
+            elif len(self._offsets) >= self.commit_every:
+                self._group_commit(self._count)
+            return number
+
+    def append_cdata(
+            self,
+            req: CdataRequest,
+            body: bytes,
+            path: str = '/iclock/cdata',
+    ) -> int:
+        # for callers that only kept the parsed request and the raw body
+        query = [('SN', req.sn), ('table', req.table.value)]
+        if req.stamp:
+            query.append(('Stamp', req.stamp))
+        if req.operation_stamp:
+            query.append(('OpStamp', req.operation_stamp))
+        if req.push_version:
+            query.append(('pushver', req.push_version))
+        return self.append(req.method, path, urlencode(query), body)
+
+    def flush(self) -> None:
+        with self._cond:
+            self._group_commit(self._count)
+
+    def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self) -> 'JournalWriter':
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.commit_interval):
+            self.flush()
+
+    def _group_commit(self, upto: int) -> None:
+        # called with the lock held, returns once records before `upto` are
+        # written; the lock is released while a commit writes, so appends
+        # arriving meanwhile are buffered for the next commit
+        while self._committed < upto:
+            if self._error is not None:
+                raise JournalError('an earlier commit failed') from self._error
+            if self._committing:
+                self._cond.wait()
+                continue
+            batch = self._take()
+            self._committing = True
+            self._cond.release()
+            try:
+                self._write(batch)
+            finally:
+                self._cond.acquire()
+                self._committing = False
+                self._cond.notify_all()
+            self._committed += len(batch[1])
+
+    def _take(self) -> typing.Tuple[bytearray, array.array]:
+        batch = self._buffer, self._offsets
+        self._buffer = bytearray()
+        self._offsets = array.array(_OFFSET)
+        return batch
+
+    def _write(self, batch: typing.Tuple[bytearray, array.array]) -> None:
+        data, offsets = batch
+        if not offsets:
+            return
+        try:
+            self._file.write(data)
+            self._file.flush()
+            # the index never points past data that made it to disk
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+            self._index.write(_index_bytes(offsets))
+            self._index.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._index.fileno())
+        except Exception as e:
+            # the batch is lost, appends waiting for it must not wait forever
+            self._error = e
+            raise
@@ -0,0 +1,92 @@
+import collections
+import contextlib
+import contextvars
+import threading
+import typing
+
+# stage names passed to Metrics.timing
+PARSE_URL = 'parse_url'
+DECODE = 'decode'
+PARSE_TABLE = 'parse_table'
+PARSE_INFO = 'parse_info'
+
+# counter names passed to Metrics.count
+BYTES_IN = 'bytes_in'
+RECORDS_OUT = 'records_out'
+UNKNOWN_ENUM = 'unknown_enum'
+DECODE_FALLBACK = 'decode_fallback'
+DECODE_FAILURE = 'decode_failure'
+
+
+class Metrics:
+    # parsers call these only while enabled, see enable()
+    def timing(self, stage: str, seconds: float,
+               sn: str = '', table: str = '') -> None:
+        pass
+
+    def count(self, name: str, value: int = 1,
+              sn: str = '', table: str = '') -> None:
+        pass
+
+
+_Key = typing.Tuple[str, str, str]
+
+
+class Counters(Metrics):
+    # in-process aggregation keyed by (stage or counter name, sn, table)
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters = collections.defaultdict(
+            int)  # type: typing.DefaultDict[_Key, int]
+        self.timings = {}  # type: typing.Dict[_Key, typing.List[float]]
+
+    def timing(self, stage: str, seconds: float,
+               sn: str = '', table: str = '') -> None:
+        key = (stage, sn, table)
+        with self._lock:
+            stats = self.timings.get(key)
+            if stats is None:
+                # calls, total seconds, max seconds
+                self.timings[key] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def count(self, name: str, value: int = 1,
+              sn: str = '', table: str = '') -> None:
+        with self._lock:
+            self.counters[(name, sn, table)] += value
+
+    def total(self, name: str) -> int:
+        return sum(v for (n, _, _), v in self.counters.items() if n == name)
+
+
+# None while instrumentation is off, hot paths only check this attribute
+current = None  # type: typing.Optional[Metrics]
+
+# (sn, table) of the request being parsed, for counts made where the request
+# isn't at hand like UNKNOWN_ENUM; only set while instrumentation is on
+labels = contextvars.ContextVar(
+    'iclockhelper_metrics_labels',
+    default=('', ''))  # type: contextvars.ContextVar[typing.Tuple[str, str]]
+
+
+@contextlib.contextmanager
+def labelled(sn: str, table: str = '') -> typing.Iterator[None]:
+    token = labels.set((sn, table))
+    try:
+        yield
+    finally:
+        labels.reset(token)
+
+
+def enable(metrics: Metrics) -> Metrics:
+    global current
+    current = metrics
+    return metrics
+
+
+def disable() -> None:
+    global current
+    current = None
@@ -1,16 +1,41 @@
+import array
+import binascii
+import collections.abc
 import datetime
 import enum
+import functools
+import io
 import typing
 
 import dataclasses as da
-import stringcase
+
+from . import metrics
 
 UNKNOWN = 'UNKNOWN'
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATETIME_CACHE_SIZE = 4096
+
+DEFAULT_INTERN_SIZE = 64 * 1024
+TIMEZONE_CACHE_SIZE = 256
+
+_IMAGE_CHUNK_SIZE = 48 * 1024  # decoded bytes per AttendancePhotoLog.iter_image chunk
+_IMAGE_SEPARATORS = b'\x00\r\n'
+_BASE64_WHITESPACE = b' \t\r\n'
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ONE_SECOND = datetime.timedelta(seconds=1)
+_HOUR = 60 * 60
+_EPOCH_HOURS = _EPOCH.toordinal() * 24
+NO_EPOCH = -2 ** 63  # epoch value of a record without a valid datetime
+
 
 class UnknowableEnum(enum.Enum):
     @classmethod
     def _missing_(cls, value):
+        if metrics.current is not None:
+            sn, table = metrics.labels.get()
+            metrics.current.count(metrics.UNKNOWN_ENUM, sn=sn, table=table)
         return cls.unknown
 
 
@@ -69,6 +94,64 @@ class OperationEnum(UnknowableEnum):
     stress_alarm = '32'
 
 
+_T = typing.TypeVar('_T')
+
+
+def _slotted_getstate(self: typing.Any) -> typing.List[typing.Any]:
+    return [getattr(self, f.name) for f in da.fields(self)]
+
+
+def _slotted_setstate(self: typing.Any, state: typing.List[typing.Any]) -> None:
+    for f, value in zip(da.fields(self), state):
+        object.__setattr__(self, f.name, value)
+
+
+def _slotted(cls: typing.Type[_T]) -> typing.Type[_T]:
+    # dataclass(slots=True) is python 3.10+, so rebuild the class with
+    # __slots__ to drop the per instance __dict__
+    inherited = set()  # type: typing.Set[str]
+    for base in cls.__mro__[1:]:
+        inherited.update(getattr(base, '__slots__', ()))
+    slots = tuple(f.name for f in da.fields(cls) if f.name not in inherited)
+    cls_dict = dict(cls.__dict__)
+    for name in slots:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    cls_dict['__slots__'] = slots
+    # frozen instances can't be restored by the default slots pickling
+    cls_dict['__getstate__'] = _slotted_getstate
+    cls_dict['__setstate__'] = _slotted_setstate
+    metaclass = type(cls)  # type: typing.Any
+    new_cls = metaclass(cls.__name__, cls.__bases__, cls_dict)
+    # generated frozen __setattr__/__delattr__ close over the original class
+    for value in cls_dict.values():
+        for cell in getattr(value, '__closure__', None) or ():
+            if cell.cell_contents is cls:
+                cell.cell_contents = new_cls
+    return new_cls
+
+
+class InternTable(dict):
+    # equal strings passed through the table share one object, the table is
+    # cleared instead of growing past max_size
+    __slots__ = ('max_size',)
+
+    def __init__(self, max_size: int = DEFAULT_INTERN_SIZE) -> None:
+        super().__init__()
+        self.max_size = max_size
+
+    def __missing__(self, value: str) -> str:
+        if len(self) >= self.max_size:
+            self.clear()
+        self[value] = value
+        return value
+
+    # hits are a plain dict lookup, only misses run python code
+    __call__ = dict.__getitem__
+
+
+@_slotted
 @da.dataclass(frozen=True)
 class ServerDatetimeMixin:
     server_datetime: typing.Optional[datetime.datetime]
@@ -76,6 +159,8 @@ class ServerDatetimeMixin:
     def correct_datetime(
             self, tz: datetime.timezone
     ) -> typing.Optional[datetime.datetime]:
+        # attaches tz as it is, a pytz zone then gives its first offset (LMT),
+        # DeviceTimezone and correct_datetimes localize() them instead
         if not self.server_datetime:
             return None
         return datetime.datetime(
@@ -89,6 +174,108 @@ class ServerDatetimeMixin:
         )
 
 
+class _MixedHour(enum.Enum):
+    # a one member enum rather than object(), mypy narrows it away with `is`
+    mixed_hour = 'mixed_hour'
+
+
+# a local hour whose UTC offset changes inside it, resolved per value
+_MIXED_HOUR = _MixedHour.mixed_hour
+_HourEntry = typing.Union[typing.Tuple[typing.Any, int], _MixedHour]
+
+
+class DeviceTimezone:
+    # attaches a device timezone to many local datetimes: the offset and
+    # tzinfo are resolved once per local hour, pytz zones through localize()
+    # so DST applies, other tzinfos like zoneinfo the way correct_datetime does;
+    # for pytz zones this differs from correct_datetime, which keeps LMT
+    def __init__(self, tz: datetime.tzinfo, max_hours: int = 64 * 1024) -> None:
+        self.tz = tz
+        self.max_hours = max_hours
+        self._localize = getattr(tz, 'localize', None)
+        # local epoch hour -> (tzinfo, utc offset seconds) or _MIXED_HOUR
+        self._hours = {}  # type: typing.Dict[int, _HourEntry]
+
+    def localize(
+            self,
+            value: typing.Optional[datetime.datetime],
+    ) -> typing.Optional[datetime.datetime]:
+        return self.localize_all((value,))[0]
+
+    def localize_all(
+            self,
+            values: typing.Iterable[typing.Optional[datetime.datetime]],
+    ) -> typing.List[typing.Optional[datetime.datetime]]:
+        if self._localize is None:
+            # the tzinfo itself works out the offset of every value
+            tz = self.tz
+            return [None if value is None else value.replace(tzinfo=tz)
+                    for value in values]
+        hours = self._hours
+        result = []  # type: typing.List[typing.Optional[datetime.datetime]]
+        for value in values:
+            if value is None:
+                result.append(None)
+                continue
+            hour = value.toordinal() * 24 + value.hour - _EPOCH_HOURS
+            entry = hours.get(hour)
+            if entry is None or entry is _MIXED_HOUR:
+                entry = self._hour(hour, value)
+            result.append(value.replace(tzinfo=entry[0]))
+        return result
+
+    def utc_epoch_seconds(self, local_epochs: typing.Iterable[int]) -> array.array:
+        # device local epoch seconds to UTC, NO_EPOCH stays as it is
+        hours = self._hours
+        result = array.array('q')
+        for local in local_epochs:
+            if local != NO_EPOCH:
+                entry = hours.get(local // _HOUR)
+                if entry is None or entry is _MIXED_HOUR:
+                    entry = self._hour(
+                        local // _HOUR, _EPOCH + datetime.timedelta(seconds=local))
+                local -= entry[1]
+            result.append(local)
+        return result
+
+    def _hour(
+            self,
+            hour: int,
+            value: datetime.datetime,
+    ) -> typing.Tuple[typing.Any, int]:
+        entry = self._hours.get(hour)
+        if entry is None:
+            start = _EPOCH + datetime.timedelta(seconds=hour * _HOUR)
+            first = self._resolve(start)
+            last = self._resolve(start + datetime.timedelta(seconds=_HOUR - 1))
+            entry = first if first == last else _MIXED_HOUR
+            if len(self._hours) >= self.max_hours:
+                self._hours.clear()
+            self._hours[hour] = entry
+        if entry is _MIXED_HOUR:
+            return self._resolve(value)
+        return entry
+
+    def _resolve(self, value: datetime.datetime) -> typing.Tuple[typing.Any, int]:
+        if self._localize is not None:
+            aware = self._localize(value)
+        else:
+            aware = value.replace(tzinfo=self.tz)
+        offset = aware.utcoffset()
+        return aware.tzinfo, offset // _ONE_SECOND if offset is not None else 0
+
+
+def _local_epoch(value: typing.Optional[datetime.datetime]) -> int:
+    return NO_EPOCH if value is None else (value - _EPOCH) // _ONE_SECOND
+
+
+@functools.lru_cache(maxsize=TIMEZONE_CACHE_SIZE)
+def device_timezone(tz: datetime.tzinfo) -> DeviceTimezone:
+    # shared per tz, so the resolved hours are reused across requests
+    return DeviceTimezone(tz)
+
+
+@_slotted
 @da.dataclass(frozen=True)
 class Transaction(ServerDatetimeMixin):
     pin: str
@@ -99,18 +286,25 @@ class Transaction(ServerDatetimeMixin):
     reserved: str = ''
 
     @classmethod
-    def from_str(cls, line: str) -> 'Transaction':
+    def from_str(
+            cls,
+            line: str,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'Transaction':
         flds = line.split('\t') + ['', '', '', '', '', '']
         pin = flds[0]
-        server_datetime = None
-        try:
-            server_datetime = datetime.datetime.strptime(flds[1], '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            pass
+        server_datetime = _parse_datetime(flds[1])
         checktype = flds[2]
         verifycode = flds[3]
         work_code = flds[4]
         reserved = flds[5]
+        if intern is not None:
+            pin = intern(pin)
+            checktype = intern(checktype)
+            verifycode = intern(verifycode)
+            work_code = intern(work_code)
+            reserved = intern(reserved)
 
         return cls(
             pin=pin,
@@ -119,7 +313,32 @@ class Transaction(ServerDatetimeMixin):
             verify_code=verifycode,
             work_code=work_code,
             reserved=reserved,
-            raw=line,
+            raw=line if keep_raw else '',
+        )
+
+    @classmethod
+    def from_bytes(
+            cls,
+            line: bytes,
+            keep_raw: bool = True,
+            decoder: typing.Optional['_FieldDecoder'] = None,
+    ) -> 'Transaction':
+        decode = decoder or _FieldDecoder(_detect_encoding(line))
+        flds = line.split(b'\t')
+        if len(flds) < 6:
+            flds += [b''] * (6 - len(flds))
+        # memo hits without a python call, misses (and '') through decode
+        memo = decode.memo.get
+        when = decode.datetimes.get(flds[1], _NOT_PARSED)
+        return cls(
+            pin=memo(flds[0]) or decode(flds[0]),
+            server_datetime=decode.parse_datetime(flds[1])
+            if when is _NOT_PARSED else when,
+            check_type=memo(flds[2]) or decode(flds[2]),
+            verify_code=memo(flds[3]) or decode(flds[3]),
+            work_code=memo(flds[4]) or decode(flds[4]),
+            reserved=memo(flds[5]) or decode(flds[5]),
+            raw=decode.text(line) if keep_raw else '',
         )
 
 
@@ -135,6 +354,7 @@ _user_fieds_map = {
 }
 
 
+@_slotted
 @da.dataclass(frozen=True)
 class User:
     pin: str
@@ -149,13 +369,13 @@ class User:
     vice_card: str = ''
 
     @classmethod
-    def from_str(cls, line: str) -> 'User':
+    def from_str(cls, line: str, keep_raw: bool = True) -> 'User':
         flds = _build_dict(line)
         return _fill_da_from_mapping(
             cls,
             _user_fieds_map,
             **{
-                'raw': line,
+                'raw': line if keep_raw else '',
                 **flds
             }
         )
@@ -163,6 +383,51 @@ class User:
 
 _DA = typing.TypeVar('_DA', covariant=True)
 
+_FIELD_PLAN_MAX_KEYS = 1024
+
+
+# raw device key -> model field name, None for keys the model doesn't have
+class _FieldPlan:
+    def __init__(self, model_type: type, mapping: typing.Mapping[str, str]):
+        self.mapping = mapping
+        self.field_names = frozenset(f.name for f in da.fields(model_type))
+        self.keys = {}  # type: typing.Dict[str, typing.Optional[str]]
+        for key in mapping:
+            self.resolve(key)
+
+    def resolve(self, key: str) -> typing.Optional[str]:
+        try:
+            return self.keys[key]
+        except KeyError:
+            pass
+        if key in self.mapping:
+            normal_key = self.mapping[key]  # type: typing.Optional[str]
+        else:
+            # only unknown keys get here, keep stringcase out of the import
+            import stringcase
+            normal_key = stringcase.snakecase(key)
+        if normal_key not in self.field_names:
+            normal_key = None
+        # devices may send arbitrary keys, don't let the plan grow unbounded
+        if len(self.keys) < _FIELD_PLAN_MAX_KEYS:
+            self.keys[key] = normal_key
+        return normal_key
+
+
+_field_plans = {}  # type: typing.Dict[typing.Tuple[type, int], _FieldPlan]
+
+
+def _field_plan(
+        model_type: type,
+        mapping: typing.Mapping[str, str],
+) -> _FieldPlan:
+    # the plan holds a reference to mapping, so its id can't be reused
+    plan_key = (model_type, id(mapping))
+    plan = _field_plans.get(plan_key)
+    if plan is None:
+        plan = _field_plans[plan_key] = _FieldPlan(model_type, mapping)
+    return plan
+
 
 def _fill_da_from_mapping(
         model_type: typing.Type[_DA],
@@ -170,12 +435,10 @@ def _fill_da_from_mapping(
         **kwargs: typing.Any,
 ) -> _DA:
     model_data = {}
-    fields_names = [f.name for f in da.fields(model_type)]
+    resolve = _field_plan(model_type, mapping).resolve
     for key, val in kwargs.items():
-        normal_key = stringcase.snakecase(key)
-        if key in mapping:
-            normal_key = mapping[key]
-        if normal_key in fields_names:
+        normal_key = resolve(key)
+        if normal_key is not None:
             model_data[normal_key] = val
     return model_type(**model_data)  # type: ignore
 
@@ -187,6 +450,7 @@ _fingerprint_fields_map = {
 }
 
 
+@_slotted
 @da.dataclass(frozen=True)
 class Fingerprint:
     pin: str
@@ -195,18 +459,19 @@ class Fingerprint:
     raw: str
 
     @classmethod
-    def from_str(cls, line: str) -> 'Fingerprint':
+    def from_str(cls, line: str, keep_raw: bool = True) -> 'Fingerprint':
         flds = _build_dict(line)
         return _fill_da_from_mapping(
             cls,
             _fingerprint_fields_map,
             **{
-                'raw': line,
+                'raw': line if keep_raw else '',
                 **flds
             }
         )
 
 
+@_slotted
 @da.dataclass(frozen=True)
 class Operation(ServerDatetimeMixin):
     object: str
@@ -219,13 +484,17 @@ class Operation(ServerDatetimeMixin):
     alarm: AlarmEnum = AlarmEnum.unknown
 
     @classmethod
-    def from_str(cls, line: str) -> 'Operation':
+    def from_str(
+            cls,
+            line: str,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'Operation':
         flds = line.split('\t')
-        logtime = None
-        try:
-            logtime = datetime.datetime.strptime(flds[2], '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            pass
+        if intern is not None:
+            # all but the datetime, which is rarely repeated
+            flds = [fld if i == 2 else intern(fld) for i, fld in enumerate(flds)]
+        logtime = _parse_datetime(flds[2])
         object = flds[3]
         operation = OperationEnum(flds[0])
         return Operation(
@@ -236,7 +505,33 @@ class Operation(ServerDatetimeMixin):
             param_1=flds[4],
             param_2=flds[5],
             param_3=flds[6],
-            raw=line,
+            raw=line if keep_raw else '',
+            alarm=AlarmEnum(
+                object) if operation == OperationEnum.alarm else AlarmEnum.unknown
+        )
+
+    @classmethod
+    def from_bytes(
+            cls,
+            line: bytes,
+            keep_raw: bool = True,
+            decoder: typing.Optional['_FieldDecoder'] = None,
+    ) -> 'Operation':
+        # like Transaction.from_bytes, the fields of from_str
+        decode = decoder or _FieldDecoder(_detect_encoding(line))
+        flds = line.split(b'\t')
+        logtime = decode.parse_datetime(flds[2])
+        object = decode(flds[3])
+        operation = OperationEnum(decode(flds[0]))
+        return cls(
+            admin=decode(flds[1]),
+            operation=operation,
+            server_datetime=logtime,
+            object=object,
+            param_1=decode(flds[4]),
+            param_2=decode(flds[5]),
+            param_3=decode(flds[6]),
+            raw=decode.text(line) if keep_raw else '',
             alarm=AlarmEnum(
                 object) if operation == OperationEnum.alarm else AlarmEnum.unknown
         )
@@ -250,7 +545,13 @@ class OperationLog:
     operations: typing.List[Operation] = da.field(default_factory=list)
 
     @classmethod
-    def from_str(cls, data: str) -> 'OperationLog':
+    def from_str(
+            cls,
+            data: str,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'OperationLog':
+        intern = intern if intern is not None else InternTable()
         users = []
         fingerprints = []
         operations = []
@@ -258,11 +559,11 @@ class OperationLog:
             ops = line.split(' ', 1)
 
             if ops[0] == 'OPLOG':
-                operations.append(Operation.from_str(ops[1]))
+                operations.append(Operation.from_str(ops[1], keep_raw, intern))
             if ops[0] == 'USER':
-                users.append(User.from_str(ops[1]))
+                users.append(User.from_str(ops[1], keep_raw))
             elif ops[0] == 'FP':
-                fingerprints.append(Fingerprint.from_str(ops[1]))
+                fingerprints.append(Fingerprint.from_str(ops[1], keep_raw))
         return cls(
             users=users,
             operations=operations,
@@ -270,44 +571,340 @@ class OperationLog:
             raw=data
         )
 
+    @classmethod
+    def from_bytes(
+            cls,
+            data: typing.Union[bytes, memoryview],
+            keep_raw: bool = True,
+            raw: typing.Optional[str] = None,
+            encoding: typing.Optional[str] = None,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'OperationLog':
+        # with keep_raw the body is decoded anyway and every record is a line
+        # of it; without, OPLOG fields are decoded one by one through the memo,
+        # USER/FP lines are key=value pairs decoded whole, other lines skipped
+        intern = intern if intern is not None else InternTable()
+        decode = _FieldDecoder(encoding or _detect_encoding(data), intern)
+        if raw is None:
+            raw = decode.text(data) if keep_raw else ''
+        if keep_raw and raw:
+            return cls.from_str(raw, intern=intern)
+        users = []
+        fingerprints = []
+        operations = []
+        for line in _iter_lines(data):
+            if line.startswith(b'OPLOG '):
+                operations.append(Operation.from_bytes(line[6:], keep_raw, decode))
+            elif line.startswith(b'USER '):
+                users.append(User.from_str(decode.text(line[5:]), keep_raw))
+            elif line.startswith(b'FP '):
+                fingerprints.append(
+                    Fingerprint.from_str(decode.text(line[3:]), keep_raw))
+        return cls(
+            users=users,
+            operations=operations,
+            fingerprints=fingerprints,
+            raw=raw,
+        )
+
+    def correct_datetimes(
+            self,
+            tz: datetime.tzinfo,
+    ) -> typing.List[typing.Optional[datetime.datetime]]:
+        # every operation's datetime in tz, see DeviceTimezone: unlike
+        # correct_datetime pytz zones go through localize()
+        return device_timezone(tz).localize_all(
+            operation.server_datetime for operation in self.operations)
+
+    def utc_epoch_seconds(self, tz: datetime.tzinfo) -> array.array:
+        return device_timezone(tz).utc_epoch_seconds(
+            _local_epoch(operation.server_datetime) for operation in self.operations)
+
+
+class StringColumn(typing.Sequence[str]):
+    # each distinct value is stored once, rows keep 4 byte codes into `values`;
+    # new values also go through `intern` when given
+    __slots__ = ('codes', 'values', 'intern', '_index')
+
+    def __init__(self, intern: typing.Optional[InternTable] = None) -> None:
+        self.codes = array.array('I')
+        self.values = []  # type: typing.List[str]
+        self.intern = intern
+        self._index = {}  # type: typing.Dict[str, int]
+
+    def append(self, value: str) -> None:
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value if self.intern is None else self.intern(value))
+        self.codes.append(code)
+
+    def __getitem__(self, index):  # type: ignore
+        if isinstance(index, slice):
+            return [self.values[code] for code in self.codes[index]]
+        return self.values[self.codes[index]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __repr__(self) -> str:
+        return 'StringColumn(rows={:d}, values={:d})'.format(
+            len(self.codes), len(self.values))
+
+
+class TransactionColumns(typing.Sequence[Transaction]):
+    # parallel arrays, Transaction objects are only built on access; without
+    # keep_raw their raw is empty, like Transaction.from_str
+    def __init__(
+            self,
+            raw: str = '',
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> None:
+        self.raw = raw
+        self.keep_raw = keep_raw
+        self.pins = StringColumn(intern)
+        self.epoch_seconds = array.array('q')
+        self.check_types = StringColumn(intern)
+        self.verify_codes = StringColumn(intern)
+        self.work_codes = StringColumn(intern)
+        self.reserved = StringColumn(intern)
+        self.offsets = array.array('q')  # start of each line in raw
+
+    @classmethod
+    def from_str(
+            cls,
+            data: str,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'TransactionColumns':
+        columns = cls(data, keep_raw, intern)
+        end = -1
+        while end < len(data):
+            start = end + 1
+            end = data.find('\n', start)
+            if end < 0:
+                end = len(data)
+            columns.append(data[start:end], start)
+        return columns
+
+    def append(self, line: str, offset: int) -> None:
+        flds = line.split('\t') + ['', '', '', '', '', '']
+        server_datetime = _parse_datetime(flds[1])
+        self.pins.append(flds[0])
+        self.epoch_seconds.append(
+            NO_EPOCH if server_datetime is None
+            else (server_datetime - _EPOCH) // _ONE_SECOND
+        )
+        self.check_types.append(flds[2])
+        self.verify_codes.append(flds[3])
+        self.work_codes.append(flds[4])
+        self.reserved.append(flds[5])
+        self.offsets.append(offset)
+
+    def column(self, name: str) -> typing.List[typing.Any]:
+        # one Transaction field for all rows without building Transactions
+        if name == 'server_datetime':
+            return [
+                None if epoch == NO_EPOCH
+                else _EPOCH + datetime.timedelta(seconds=epoch)
+                for epoch in self.epoch_seconds
+            ]
+        if name == 'raw':
+            return [self._raw_line(i) for i in range(len(self))]
+        strings = self._string_columns[name]
+        return [strings.values[code] for code in strings.codes]
+
+    @property
+    def _string_columns(self) -> typing.Dict[str, StringColumn]:
+        return {
+            'pin': self.pins,
+            'check_type': self.check_types,
+            'verify_code': self.verify_codes,
+            'work_code': self.work_codes,
+            'reserved': self.reserved,
+        }
+
+    def _raw_line(self, index: int) -> str:
+        if not self.keep_raw:
+            return ''
+        start = self.offsets[index]
+        if index + 1 < len(self.offsets):
+            return self.raw[start:self.offsets[index + 1] - 1]
+        return self.raw[start:]
+
+    def _transaction(self, index: int) -> Transaction:
+        epoch = self.epoch_seconds[index]
+        return Transaction(
+            pin=self.pins[index],
+            server_datetime=None if epoch == NO_EPOCH
+            else _EPOCH + datetime.timedelta(seconds=epoch),
+            check_type=self.check_types[index],
+            verify_code=self.verify_codes[index],
+            work_code=self.work_codes[index],
+            reserved=self.reserved[index],
+            raw=self._raw_line(index),
+        )
+
+    def __getitem__(self, index):  # type: ignore
+        if isinstance(index, slice):
+            return [self._transaction(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('transaction index out of range')
+        return self._transaction(index)
+
+    def __iter__(self) -> typing.Iterator[Transaction]:
+        for index in range(len(self)):
+            yield self._transaction(index)
+
+    def __len__(self) -> int:
+        return len(self.epoch_seconds)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return 'TransactionColumns(rows={:d})'.format(len(self))
+
 
 @da.dataclass(frozen=True)
 class AttendanceLog:
     raw: str
-    transactions: typing.List[Transaction] = da.field(default_factory=list)
+    transactions: typing.Sequence[Transaction] = da.field(default_factory=list)
 
     @classmethod
-    def from_str(cls, data: str) -> 'AttendanceLog':
+    def from_str(
+            cls,
+            data: str,
+            columnar: bool = False,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'AttendanceLog':
+        # columnar transactions slice raw lazily from `data` by offsets
+        if columnar:
+            return cls(
+                transactions=TransactionColumns.from_str(data, keep_raw, intern),
+                raw=data,
+            )
+        intern = intern if intern is not None else InternTable()
         transactions = []
         for line in data.split('\n'):
-            transactions.append(Transaction.from_str(line))
+            transactions.append(Transaction.from_str(line, keep_raw, intern))
         return cls(
             transactions=transactions,
             raw=data,
         )
 
+    @classmethod
+    def from_bytes(
+            cls,
+            data: typing.Union[bytes, memoryview],
+            keep_raw: bool = True,
+            raw: typing.Optional[str] = None,
+            encoding: typing.Optional[str] = None,
+            intern: typing.Optional[InternTable] = None,
+    ) -> 'AttendanceLog':
+        # with keep_raw the body is decoded anyway and every transaction is a
+        # line of it, without only the fields are decoded, through the memo
+        decode = _FieldDecoder(encoding or _detect_encoding(data), intern)
+        if raw is None:
+            raw = decode.text(data) if keep_raw else ''
+        if keep_raw and raw:
+            return cls.from_str(raw, intern=intern)
+        transactions = [
+            Transaction.from_bytes(line, keep_raw, decode)
+            for line in _iter_lines(data)
+        ]
+        return cls(
+            transactions=transactions,
+            raw=raw,
+        )
+
+    @classmethod
+    def iter_stream(
+            cls,
+            stream: typing.Union[bytes, typing.BinaryIO],
+            chunk_size: int = 64 * 1024,
+            length: typing.Optional[int] = None,
+            keep_raw: bool = True,
+            intern: typing.Optional[InternTable] = None,
+            encoding: typing.Optional[str] = None,
+    ) -> typing.Iterator[Transaction]:
+        # transactions one line at a time, reading chunk_size bytes at a time;
+        # `length` limits reads for streams like wsgi.input (CONTENT_LENGTH);
+        # lines are decoded with `encoding`, e.g. EncodingStrategy.hint(sn),
+        # or the one detected per line; like from_str, a trailing '\n' or an
+        # empty stream yields an empty Transaction
+        intern = intern if intern is not None else InternTable()
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(stream)
+        tail = b''
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                yield Transaction.from_str(_decode(line, encoding), keep_raw, intern)
+        yield Transaction.from_str(_decode(tail, encoding), keep_raw, intern)
+
+    def correct_datetimes(
+            self,
+            tz: datetime.tzinfo,
+    ) -> typing.List[typing.Optional[datetime.datetime]]:
+        # every transaction's datetime in tz, see DeviceTimezone: unlike
+        # correct_datetime pytz zones go through localize()
+        transactions = self.transactions
+        if isinstance(transactions, TransactionColumns):
+            values = transactions.column('server_datetime')
+        else:
+            values = [t.server_datetime for t in transactions]
+        return device_timezone(tz).localize_all(values)
+
+    def utc_epoch_seconds(self, tz: datetime.tzinfo) -> array.array:
+        # UTC epoch seconds of every transaction, NO_EPOCH without a datetime
+        transactions = self.transactions
+        if isinstance(transactions, TransactionColumns):
+            local_epochs = transactions.epoch_seconds  # type: typing.Iterable[int]
+        else:
+            local_epochs = (_local_epoch(t.server_datetime) for t in transactions)
+        return device_timezone(tz).utc_epoch_seconds(local_epochs)
+
 
 @da.dataclass(frozen=True)
 class AttendancePhotoLog(ServerDatetimeMixin):
+    # not slotted: from_bytes leaves data and raw to _PhotoText
     raw: str
     pin: str = ''
     is_uploadphoto: bool = False
     is_realupload: bool = False
     data: str = ''
 
-    @classmethod
-    def from_request_pin(cls, req_pin: str, body: str) -> 'AttendancePhotoLog':
-        pin = ''
-        if not req_pin:  # pin not in req params
-            body_dict = _build_dict(body.split('CMD=')[0], '\n')
-            req_pin = body_dict.get('PIN', '')
-
-        pin_split = req_pin.split('.')[0].split('-')  # type: typing.List[str]
-        dt = pin_split[0]
-        if len(pin_split) == 2:  # Success Picture
-            pin = pin_split[1]
-        server_datetime = datetime.datetime.strptime(dt, '%Y%m%d%H%M%S')
+    # not fields: the upload body of from_bytes, where data and the base64
+    # image start in it and what raw has in front of data
+    _body = b''  # type: typing.Union[bytes, memoryview]
+    _data_start = 0
+    _image_start = 0
+    _raw_prefix = ''
 
+    @classmethod
+    def from_request_pin(
+            cls,
+            req_pin: str,
+            body: str,
+            keep_raw: bool = True,
+    ) -> 'AttendancePhotoLog':
         image_data = ''
         is_uploadphoto = False
         is_realupload = False
@@ -319,13 +916,178 @@ class AttendancePhotoLog(ServerDatetimeMixin):
             image_data = body.split('CMD=realupload')[1]
             is_realupload = True
 
+        req_pin, pin, server_datetime = _photo_pin(req_pin, body.split('CMD=')[0])
         return cls(
             pin=pin,
             server_datetime=server_datetime,
             is_uploadphoto=is_uploadphoto,
             is_realupload=is_realupload,
             data=image_data,
-            raw=req_pin + body,
+            raw=req_pin + body if keep_raw else '',
+        )
+
+    @classmethod
+    def from_bytes(
+            cls,
+            req_pin: str,
+            data: bytes,
+            keep_raw: bool = True,
+            encoding: typing.Optional[str] = None,
+    ) -> 'AttendancePhotoLog':
+        # only the header is decoded, the image stays in data and is
+        # decoded into data and raw on first access
+        data_start, command = _photo_split(data)
+        header = _decode(data[:data_start], encoding)
+        is_uploadphoto = command == _UPLOADPHOTO
+        is_realupload = command == _REALUPLOAD
+
+        req_pin, pin, server_datetime = _photo_pin(req_pin, header.split('CMD=')[0])
+        photo = cls(
+            pin=pin,
+            server_datetime=server_datetime,
+            is_uploadphoto=is_uploadphoto,
+            is_realupload=is_realupload,
+            raw='',
+        )
+        if command:
+            image_start = data_start
+            while image_start < len(data) and data[image_start] in _IMAGE_SEPARATORS:
+                image_start += 1
+            object.__setattr__(photo, '_body', data)
+            object.__setattr__(photo, '_data_start', data_start)
+            object.__setattr__(photo, '_image_start', image_start)
+            object.__delattr__(photo, 'data')
+        if keep_raw:
+            object.__setattr__(photo, '_raw_prefix', req_pin + header)
+            object.__delattr__(photo, 'raw')
+        return photo
+
+    @property
+    def image(self) -> memoryview:
+        # base64 image without the separator in front of it, a view of the
+        # from_bytes body rather than a copy
+        if self._body:
+            return memoryview(self._body)[self._image_start:]
+        view = memoryview(self.data.encode('ascii'))
+        start = 0
+        while start < len(view) and view[start] in _IMAGE_SEPARATORS:
+            start += 1
+        return view[start:]
+
+    def iter_image(
+            self,
+            chunk_size: int = _IMAGE_CHUNK_SIZE,
+    ) -> typing.Iterator[bytes]:
+        # decoded image in chunks, never the whole image in memory at once;
+        # line breaks of wrapped base64 are dropped and the characters short
+        # of a 4 character group carried into the next chunk
+        view = self.image
+        step = max(chunk_size // 3, 1) * 4
+        carry = b''
+        for offset in range(0, len(view), step):
+            chunk = carry + view[offset:offset + step].tobytes().translate(
+                None, _BASE64_WHITESPACE)
+            end = len(chunk) - len(chunk) % 4
+            carry = chunk[end:]
+            if end:
+                yield binascii.a2b_base64(chunk[:end])
+        if carry:
+            # a truncated image fails like it does in one piece
+            yield binascii.a2b_base64(carry)
+
+    def write_image(
+            self,
+            fileobj: typing.BinaryIO,
+            chunk_size: int = _IMAGE_CHUNK_SIZE,
+    ) -> int:
+        size = 0
+        for chunk in self.iter_image(chunk_size):
+            size += fileobj.write(chunk)
+        return size
+
+
+class _PhotoText:
+    # non-data descriptor like requests._LazyField: the base64 image of
+    # AttendancePhotoLog.from_bytes is decoded into data and raw on first
+    # access only, then the value lives in the instance __dict__
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj: typing.Optional[AttendancePhotoLog],
+                objtype: typing.Any = None) -> str:
+        if obj is None:
+            return ''
+        if self.name == 'data':
+            # base64 and the separators in front of it are ascii
+            value = str(memoryview(obj._body)[obj._data_start:], 'latin-1')
+        else:
+            value = obj._raw_prefix + obj.data
+        obj.__dict__[self.name] = value
+        return value
+
+
+AttendancePhotoLog.data = _PhotoText('data')  # type: ignore
+AttendancePhotoLog.raw = _PhotoText('raw')  # type: ignore
+
+_UPLOADPHOTO = b'CMD=uploadphoto'
+_REALUPLOAD = b'CMD=realupload'
+
+
+def _photo_split(data: bytes) -> typing.Tuple[int, bytes]:
+    # offset of the image and the upload command in front of it
+    start = data.find(b'CMD=')
+    if start < 0:
+        return len(data), b''
+    for command in (_REALUPLOAD, _UPLOADPHOTO):
+        if data.startswith(command, start):
+            return start + len(command), command
+    return len(data), b''
+
+
+def _photo_pin(
+        req_pin: str,
+        header: str,
+) -> typing.Tuple[str, str, datetime.datetime]:
+    # the request pin, from the header when not in the query, with the pin
+    # and datetime it holds
+    pin = ''
+    if not req_pin:  # pin not in req params
+        req_pin = _build_dict(header, '\n').get('PIN', '')
+
+    pin_split = req_pin.split('.')[0].split('-')  # type: typing.List[str]
+    dt = pin_split[0]
+    if len(pin_split) == 2:  # Success Picture
+        pin = pin_split[1]
+    return req_pin, pin, datetime.datetime.strptime(dt, '%Y%m%d%H%M%S')
+
+
+_command_return_fields_map = {
+    'ID': 'id',
+    'Return': 'return_code',
+    'CMD': 'cmd',
+}
+
+
+@_slotted
+@da.dataclass(frozen=True)
+class CommandReturn:
+    id: str
+    return_code: str
+    raw: str
+    cmd: str = ''
+
+    @classmethod
+    def from_str(cls, line: str, keep_raw: bool = True) -> 'CommandReturn':
+        flds = _build_dict(line.rstrip('\r'), '&')
+        return _fill_da_from_mapping(
+            cls,
+            _command_return_fields_map,
+            **{
+                'id': '',
+                'return_code': '',
+                'raw': line if keep_raw else '',
+                **flds
+            }
         )
 
 
@@ -337,3 +1099,137 @@ def _build_dict(ops_1: str, separator: str = '\t') -> typing.Dict[str, str]:
             flds[item[:index]] = item[index + 1:]
 
     return flds
+
+
+_LINES_CHUNK_SIZE = 64 * 1024
+_FIELD_MEMO_SIZE = 64 * 1024
+
+
+class _NotParsed(enum.Enum):
+    # like _MixedHour, a marker mypy narrows away with `is`
+    not_parsed = 'not_parsed'
+
+
+# a timestamp missing from a memo, None is a parsed, invalid one
+_NOT_PARSED = _NotParsed.not_parsed
+
+
+def _iter_lines(data: typing.Union[bytes, memoryview]) -> typing.Iterator[bytes]:
+    # same lines as data.split(b'\n') without a list of the whole body
+    if isinstance(data, memoryview):
+        yield from _iter_view_lines(data)
+        return
+    pos = 0
+    while True:
+        end = data.find(b'\n', pos + _LINES_CHUNK_SIZE) \
+            if pos + _LINES_CHUNK_SIZE < len(data) else -1
+        if end < 0:
+            yield from data[pos:].split(b'\n')
+            return
+        yield from data[pos:end].split(b'\n')
+        pos = end + 1
+
+
+def _iter_view_lines(view: memoryview) -> typing.Iterator[bytes]:
+    # memoryview can't find or split, it's copied a chunk at a time
+    tail = b''
+    for pos in range(0, len(view), _LINES_CHUNK_SIZE):
+        lines = (tail + view[pos:pos + _LINES_CHUNK_SIZE].tobytes()).split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    yield tail
+
+
+def _isascii(data: typing.Union[bytes, memoryview]) -> bool:
+    if isinstance(data, memoryview):
+        return all(
+            data[pos:pos + _LINES_CHUNK_SIZE].tobytes().isascii()
+            for pos in range(0, len(data), _LINES_CHUNK_SIZE))
+    return data.isascii()
+
+
+def _detect_encoding(data: typing.Union[bytes, memoryview]) -> str:
+    return 'ascii' if _isascii(data) else 'gb18030'
+
+
+class _FieldDecoder:
+    # decodes each distinct field value once per body, equal values share a str
+    # which also comes from `intern` when given, e.g. a per device table
+    __slots__ = ('encoding', 'intern', 'memo', 'datetimes')
+
+    def __init__(
+            self,
+            encoding: str,
+            intern: typing.Optional[InternTable] = None,
+    ) -> None:
+        self.encoding = encoding
+        self.intern = intern
+        self.memo = {}  # type: typing.Dict[bytes, str]
+        self.datetimes = {
+        }  # type: typing.Dict[bytes, typing.Optional[datetime.datetime]]
+
+    def __call__(self, value: bytes) -> str:
+        text = self.memo.get(value)
+        if text is None:
+            text = self.text(value)
+            if self.intern is not None:
+                text = self.intern(text)
+            if len(self.memo) < _FIELD_MEMO_SIZE:
+                self.memo[value] = text
+        return text
+
+    def parse_datetime(self, value: bytes) -> typing.Optional[datetime.datetime]:
+        # a memo of its own, timestamps don't go through `intern`
+        parsed = self.datetimes.get(value, _NOT_PARSED)
+        if parsed is _NOT_PARSED:
+            parsed = _parse_datetime(self.text(value))
+            if len(self.datetimes) < _FIELD_MEMO_SIZE:
+                self.datetimes[value] = parsed
+        return parsed
+
+    def text(self, value: typing.Union[bytes, memoryview]) -> str:
+        try:
+            return str(value, self.encoding)
+        except UnicodeDecodeError:
+            return ''
+
+
+def _decode(
+        data: typing.Union[bytes, memoryview],
+        encoding: typing.Optional[str] = None,
+) -> str:
+    # a single decode, with `encoding` or the detected one
+    try:
+        return str(data, encoding or _detect_encoding(data))
+    except UnicodeDecodeError:
+        return ''
+
+
+def _parse_datetime_uncached(value: str) -> typing.Optional[datetime.datetime]:
+    # fixed width "YYYY-MM-DD HH:MM:SS" is decoded without the strptime regex,
+    # anything else goes through strptime to keep its leniency
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' \
+            and value[10] == ' ' and value[13] == ':' and value[16] == ':':
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+_parse_datetime = functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)(
+    _parse_datetime_uncached
+)  # type: typing.Callable[[str], typing.Optional[datetime.datetime]]
+
+
+def configure_datetime_cache(maxsize: int = DATETIME_CACHE_SIZE) -> None:
+    global _parse_datetime
+    if maxsize > 0:
+        _parse_datetime = functools.lru_cache(maxsize=maxsize)(
+            _parse_datetime_uncached
+        )
+    else:
+        _parse_datetime = _parse_datetime_uncached
@@ -1,12 +1,26 @@
 import collections
+import functools
+import time
 import typing
-from urllib.parse import ParseResult, parse_qs, urlparse
-from urllib.request import Request
+from urllib.parse import unquote, urlparse
 
 import dataclasses as da
-import stringcase
 
-from .models import AttendanceLog, AttendancePhotoLog, OperationLog, TableEnum
+from . import metrics
+from .models import (
+    DEFAULT_INTERN_SIZE,
+    AttendanceLog,
+    AttendancePhotoLog,
+    CommandReturn,
+    InternTable,
+    OperationLog,
+    TableEnum,
+    _field_plan,
+    _photo_split
+)
+
+if typing.TYPE_CHECKING:  # urllib.request is slow to import
+    from urllib.request import Request
 
 
 @da.dataclass(frozen=True)
@@ -46,39 +60,234 @@ class GetRequest(ZKRequest):
     info: Info
 
     @staticmethod
-    def from_req(req: Request):
-        parsed_req = _ParsedRequest.from_req(req)
+    def from_req(req: 'Request'):
+        start = time.perf_counter() if metrics.current is not None else 0.0
+        return GetRequest._from_parsed(_ParsedRequest.from_req(req), start)
+
+    @staticmethod
+    def from_parts(
+            method: str,
+            query_string: str,
+            body: bytes = b'',
+    ) -> 'GetRequest':
+        start = time.perf_counter() if metrics.current is not None else 0.0
+        return GetRequest._from_parsed(
+            _ParsedRequest.from_parts(method, query_string, body), start)
+
+    @staticmethod
+    def _from_parsed(parsed_req: '_ParsedRequest', start: float) -> 'GetRequest':
         (sn, pushver) = _extract_sn_version(parsed_req)
+        instr = metrics.current
+        if instr is None or not start:
+            info = _device_info(sn, parsed_req.params.get('INFO', ''))
+        else:
+            parsed = time.perf_counter()
+            instr.timing(metrics.PARSE_URL, parsed - start, sn)
+            info = _device_info(sn, parsed_req.params.get('INFO', ''))
+            instr.timing(metrics.PARSE_INFO, time.perf_counter() - parsed, sn)
         return GetRequest(
             sn=sn,
             push_version=pushver,
-            info=_fill_plain_info(parsed_req.params.get('INFO', '')),
+            info=info,
+        )
+
+
+@da.dataclass(frozen=True)
+class DeviceCmdRequest(ZKRequest):
+    returns: typing.List[CommandReturn] = da.field(default_factory=list)
+
+    @staticmethod
+    def from_req(
+            req: 'Request',
+            encoding_strategy: typing.Optional['EncodingStrategy'] = None,
+    ) -> 'DeviceCmdRequest':
+        return DeviceCmdRequest._from_parsed(
+            _ParsedRequest.from_req(req), encoding_strategy)
+
+    @staticmethod
+    def from_parts(
+            method: str,
+            query_string: str,
+            body: bytes = b'',
+            encoding_strategy: typing.Optional['EncodingStrategy'] = None,
+    ) -> 'DeviceCmdRequest':
+        return DeviceCmdRequest._from_parsed(
+            _ParsedRequest.from_parts(method, query_string, body), encoding_strategy)
+
+    @staticmethod
+    def _from_parsed(
+            parsed_req: '_ParsedRequest',
+            encoding_strategy: typing.Optional['EncodingStrategy'],
+    ) -> 'DeviceCmdRequest':
+        (sn, pushver) = _extract_sn_version(parsed_req)
+        strategy = encoding_strategy or default_encoding_strategy
+        body = strategy.decode(parsed_req.body, sn)[0]
+        return DeviceCmdRequest(
+            sn=sn,
+            push_version=pushver,
+            # replies like INFO carry extra key=value lines after the ID line
+            returns=[CommandReturn.from_str(line) for line in body.split('\n')
+                     if line.startswith('ID=')],
         )
 
 
 @da.dataclass(frozen=True)
 class _ParsedRequest:
-    req: Request
     method: str
-    parseresult: ParseResult
+    query: str
     params: typing.Dict[str, typing.Any]
     body: bytes
-    headers: typing.Dict[str, str]
+    headers: typing.Mapping[str, str] = da.field(default_factory=dict)
+    req: typing.Optional['Request'] = None
 
     @classmethod
-    def from_req(cls, req: Request) -> '_ParsedRequest':
-        parseresult = urlparse(req.get_full_url())
+    def from_req(cls, req: 'Request') -> '_ParsedRequest':
+        query = urlparse(req.get_full_url()).query
         return cls(
             req=req,
             method=req.get_method(),
             headers=req.headers,
             body=req.data or b'',
-            parseresult=parseresult,
-            params={k: v if len(v) > 1 else v[0] for k, v in
-                    parse_qs(parseresult.query).items()},
+            query=query,
+            params=_parse_query(query),
+        )
+
+    @classmethod
+    def from_parts(
+            cls,
+            method: str,
+            query_string: str,
+            body: bytes = b'',
+    ) -> '_ParsedRequest':
+        return cls(
+            method=method.upper(),
+            body=body or b'',
+            query=query_string,
+            params=_parse_query(query_string),
         )
 
 
+def _parse_query(query: str) -> typing.Dict[str, typing.Any]:
+    # parse_qs without blank values, single values aren't wrapped in a list;
+    # device queries are plain ascii so unquote is usually skipped
+    params = {}  # type: typing.Dict[str, typing.Any]
+    for pair in query.split('&'):
+        name, sep, value = pair.partition('=')
+        if not value:
+            continue
+        if '%' in name or '+' in name:
+            name = unquote(name.replace('+', ' '))
+        if '%' in value or '+' in value:
+            value = unquote(value.replace('+', ' '))
+        current = params.get(name)
+        if current is None:
+            params[name] = value
+        elif isinstance(current, list):
+            current.append(value)
+        else:
+            params[name] = [current, value]
+    return params
+
+
+class EncodingStrategy:
+    # ascii bodies are recognised without decoding, others are decoded once
+    # with the encoding that last worked for the device, then the fallbacks
+    def __init__(
+            self,
+            encodings: typing.Sequence[str] = ('gb18030',),
+            max_devices: int = 10000,
+    ) -> None:
+        self.encodings = tuple(encodings)
+        self.max_devices = max_devices
+        self._hints = {}  # type: typing.Dict[str, str]
+
+    def hint(self, sn: str) -> str:
+        return self._hints.get(sn, self.encodings[0])
+
+    def decode(self, data: bytes, sn: str = '') -> typing.Tuple[str, str]:
+        if data.isascii():
+            return data.decode('ascii'), 'ascii'
+        hint = self.hint(sn)
+        for encoding in (hint,) + tuple(e for e in self.encodings if e != hint):
+            try:
+                text = data.decode(encoding)
+            except UnicodeDecodeError:
+                if metrics.current is not None:
+                    metrics.current.count(
+                        metrics.DECODE_FALLBACK, sn=sn, table=metrics.labels.get()[1])
+                continue
+            if sn and encoding != hint:
+                self._remember(sn, encoding)
+            return text, encoding
+        if metrics.current is not None:
+            metrics.current.count(
+                metrics.DECODE_FAILURE, sn=sn, table=metrics.labels.get()[1])
+        return '', ''
+
+    def _remember(self, sn: str, encoding: str) -> None:
+        if sn not in self._hints and len(self._hints) >= self.max_devices:
+            self._hints.pop(next(iter(self._hints)), None)
+        self._hints[sn] = encoding
+
+
+default_encoding_strategy = EncodingStrategy()
+
+
+class DeviceInternTables:
+    # one InternTable per device, so pins and codes of every upload from a
+    # device share their str objects
+    def __init__(
+            self,
+            max_devices: int = 10000,
+            max_size: int = DEFAULT_INTERN_SIZE,
+    ) -> None:
+        self.max_devices = max_devices
+        self.max_size = max_size
+        self._tables = {}  # type: typing.Dict[str, InternTable]
+
+    def get(self, sn: str) -> InternTable:
+        table = self._tables.get(sn)
+        if table is None:
+            if len(self._tables) >= self.max_devices:
+                self._tables.pop(next(iter(self._tables)), None)
+            table = self._tables[sn] = InternTable(self.max_size)
+        return table
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        # a cache: process pool workers start with empty tables
+        return DeviceInternTables, (self.max_devices, self.max_size)
+
+
+class _CdataPayload:
+    __slots__ = (
+        'data', 'text', 'pin', 'keep_raw', 'sn', 'strategy', 'intern', '_decoded')
+
+    def __init__(
+            self,
+            data: bytes,
+            pin: str,
+            keep_raw: bool,
+            sn: str,
+            strategy: EncodingStrategy,
+            text: typing.Optional[bytes] = None,
+            intern: typing.Optional[InternTable] = None,
+    ) -> None:
+        self.data = data
+        # the part of data the encoding is detected on
+        self.text = data if text is None else text
+        self.pin = pin
+        self.keep_raw = keep_raw
+        self.sn = sn
+        self.strategy = strategy
+        self.intern = intern
+        self._decoded = None  # type: typing.Optional[typing.Tuple[str, str]]
+
+    def decoded(self) -> typing.Tuple[str, str]:
+        if self._decoded is None:
+            self._decoded = self.strategy.decode(self.text, self.sn)
+        return self._decoded
+
+
 @da.dataclass(frozen=True)
 class CdataRequest(ZKRequest):
     method: str
@@ -91,12 +300,55 @@ class CdataRequest(ZKRequest):
     attendance_log: typing.Optional[AttendanceLog] = None
     operation_log: typing.Optional[OperationLog] = None
     attendance_photo_log: typing.Optional[AttendancePhotoLog] = None
+    # fields added later go last, positional construction stays as it was
+    encoding: str = ''
+    options: str = ''
+
+    # not a field: the unparsed POST body behind the lazy fields
+    _payload = None  # type: typing.Optional[_CdataPayload]
+
+    @staticmethod
+    def from_req(
+            req: 'Request',
+            keep_raw: bool = True,
+            lazy: bool = False,
+            encoding_strategy: typing.Optional[EncodingStrategy] = None,
+            intern_tables: typing.Optional[DeviceInternTables] = None,
+    ) -> 'CdataRequest':
+        start = time.perf_counter() if metrics.current is not None else 0.0
+        return CdataRequest._from_parsed(
+            _ParsedRequest.from_req(req), start,
+            keep_raw, lazy, encoding_strategy, intern_tables)
 
     @staticmethod
-    def from_req(req: Request) -> 'CdataRequest':
-        parsed_req = _ParsedRequest.from_req(req)
+    def from_parts(
+            method: str,
+            query_string: str,
+            body: bytes = b'',
+            keep_raw: bool = True,
+            lazy: bool = False,
+            encoding_strategy: typing.Optional[EncodingStrategy] = None,
+            intern_tables: typing.Optional[DeviceInternTables] = None,
+    ) -> 'CdataRequest':
+        # for servers that already have the query string and body, no Request
+        start = time.perf_counter() if metrics.current is not None else 0.0
+        return CdataRequest._from_parsed(
+            _ParsedRequest.from_parts(method, query_string, body), start,
+            keep_raw, lazy, encoding_strategy, intern_tables)
 
+    @staticmethod
+    def _from_parsed(
+            parsed_req: '_ParsedRequest',
+            start: float,
+            keep_raw: bool,
+            lazy: bool,
+            encoding_strategy: typing.Optional[EncodingStrategy],
+            intern_tables: typing.Optional[DeviceInternTables],
+    ) -> 'CdataRequest':
         (sn, pushver) = _extract_sn_version(parsed_req)
+        instr = metrics.current
+        if instr is not None and start:
+            instr.timing(metrics.PARSE_URL, time.perf_counter() - start, sn)
         method = parsed_req.method
         action = parsed_req.params.get('action', '')
         if action:
@@ -115,45 +367,53 @@ class CdataRequest(ZKRequest):
                 method=method,
                 pin=pin,
                 save=save,
+                options=_from_maps('options', '', parsed_req.params),
             )
         if method == 'POST':
             stamp = _from_maps('Stamp', '', parsed_req.params)
             operation_stamp = _from_maps('OpStamp', '', parsed_req.params)
-            table = TableEnum(_from_maps('table', None, parsed_req.params))
-            body = ''
-            try:
-                body = parsed_req.body.decode('ascii')
-            except UnicodeDecodeError:
-                try:
-                    body = parsed_req.body.decode('gb18030')
-                except UnicodeDecodeError:
-                    pass
-
-            operlog = att_log = att_photo = None
-            if table == TableEnum.operlog:
-                operlog = OperationLog.from_str(body)
-
-            if table == TableEnum.attlog:
-                att_log = AttendanceLog.from_str(body)
-
-            if table == TableEnum.attphoto:
-                att_photo = AttendancePhotoLog.from_request_pin(
-                    _from_maps('PIN', '', parsed_req.params),
-                    body,
-                )
-
-            return CdataRequest(
+            table_value = _from_maps('table', None, parsed_req.params)
+            if instr is None:
+                table = TableEnum(table_value)
+            else:
+                with metrics.labelled(sn):
+                    table = TableEnum(table_value)
+
+            cdata_req = CdataRequest(
                 sn=sn,
                 push_version=pushver,
                 method=method,
                 table=table,
                 stamp=stamp,
                 operation_stamp=operation_stamp,
-                body=body,
-                attendance_log=att_log,
-                attendance_photo_log=att_photo,
-                operation_log=operlog
             )
+            if instr is not None:
+                instr.count(metrics.BYTES_IN, len(parsed_req.body), sn, table.value)
+            # body and logs are resolved by _LazyField on first access
+            object.__setattr__(cdata_req, '_payload', _CdataPayload(
+                data=parsed_req.body,
+                pin=_from_maps('PIN', '', parsed_req.params),
+                keep_raw=keep_raw,
+                sn=sn,
+                strategy=encoding_strategy or default_encoding_strategy,
+                # photo bodies are only decoded up to the image
+                text=_photo_header(parsed_req.body) if table == TableEnum.attphoto
+                else None,
+                intern=intern_tables.get(sn) if intern_tables is not None else None,
+            ))
+            for name in _LAZY_FIELDS:
+                object.__delattr__(cdata_req, name)
+            if not lazy:
+                # the logs are parsed from the bytes; body is only decoded
+                # here when the logs keep raw lines of it anyway, photo images
+                # and bodies without keep_raw are left to the first access
+                lazy_body = table == TableEnum.attphoto or not keep_raw
+                for name in _LAZY_FIELDS:
+                    if name != 'body' or not lazy_body:
+                        getattr(cdata_req, name)
+                if not lazy_body:
+                    object.__delattr__(cdata_req, '_payload')
+            return cdata_req
 
         return CdataRequest(
             sn=sn,
@@ -162,6 +422,140 @@ class CdataRequest(ZKRequest):
         )
 
 
+class _LazyField:
+    # non-data descriptor: once parsed the value lives in the instance
+    # __dict__ and shadows the descriptor, like functools.cached_property
+    def __init__(
+            self,
+            name: str,
+            default: typing.Any,
+            parse: typing.Callable[[CdataRequest, _CdataPayload], typing.Any],
+            stage: str = '',
+    ) -> None:
+        self.name = name
+        self.default = default
+        self.parse = parse
+        self.stage = stage
+
+    def __get__(self, obj: typing.Optional[CdataRequest],
+                objtype: typing.Any = None) -> typing.Any:
+        payload = obj._payload if obj is not None else None
+        if obj is None or payload is None:
+            return self.default
+        instr = metrics.current
+        if instr is None:
+            value = self.parse(obj, payload)
+        else:
+            # counts made while parsing, e.g. decode fallbacks, get sn and table
+            with metrics.labelled(obj.sn, obj.table.value):
+                value = self._measured(instr, obj, payload) if self.stage \
+                    else self.parse(obj, payload)
+        obj.__dict__[self.name] = value
+        return value
+
+    def _measured(
+            self,
+            instr: metrics.Metrics,
+            obj: CdataRequest,
+            payload: _CdataPayload,
+    ) -> typing.Any:
+        start = time.perf_counter()
+        value = self.parse(obj, payload)
+        if value is None:
+            # a log of another table
+            return value
+        instr.timing(self.stage, time.perf_counter() - start, obj.sn, obj.table.value)
+        if self.stage == metrics.PARSE_TABLE:
+            instr.count(metrics.RECORDS_OUT, _record_count(value),
+                        obj.sn, obj.table.value)
+        return value
+
+
+def _record_count(value: typing.Any) -> int:
+    if isinstance(value, AttendanceLog):
+        return len(value.transactions)
+    if isinstance(value, OperationLog):
+        return len(value.users) + len(value.fingerprints) + len(value.operations)
+    return 1
+
+
+def _parse_body(req: CdataRequest, payload: _CdataPayload) -> str:
+    text = payload.decoded()[0]
+    if len(payload.text) < len(payload.data):
+        # the base64 photo after the header is ascii
+        text += str(memoryview(payload.data)[len(payload.text):], 'latin-1')
+    return text
+
+
+def _parse_encoding(req: CdataRequest, payload: _CdataPayload) -> str:
+    if payload.text.isascii():
+        return 'ascii'
+    return payload.decoded()[1]
+
+
+def _parse_attendance_log(
+        req: CdataRequest,
+        payload: _CdataPayload,
+) -> typing.Optional[AttendanceLog]:
+    if req.table != TableEnum.attlog:
+        return None
+    return AttendanceLog.from_bytes(
+        payload.data,
+        keep_raw=payload.keep_raw,
+        raw=req.body if payload.keep_raw else '',
+        encoding=req.encoding or None,
+        intern=payload.intern,
+    )
+
+
+def _parse_operation_log(
+        req: CdataRequest,
+        payload: _CdataPayload,
+) -> typing.Optional[OperationLog]:
+    if req.table != TableEnum.operlog:
+        return None
+    return OperationLog.from_bytes(
+        payload.data,
+        keep_raw=payload.keep_raw,
+        raw=req.body if payload.keep_raw else '',
+        encoding=req.encoding or None,
+        intern=payload.intern,
+    )
+
+
+def _parse_attendance_photo_log(
+        req: CdataRequest,
+        payload: _CdataPayload,
+) -> typing.Optional[AttendancePhotoLog]:
+    if req.table != TableEnum.attphoto:
+        return None
+    return AttendancePhotoLog.from_bytes(
+        payload.pin, payload.data, payload.keep_raw, encoding=req.encoding or None)
+
+
+_LAZY_FIELDS = (
+    'body',
+    'encoding',
+    'attendance_log',
+    'operation_log',
+    'attendance_photo_log',
+)
+
+CdataRequest.body = _LazyField(  # type: ignore
+    'body', '', _parse_body, metrics.DECODE)
+CdataRequest.encoding = _LazyField('encoding', '', _parse_encoding)  # type: ignore
+CdataRequest.attendance_log = _LazyField(  # type: ignore
+    'attendance_log', None, _parse_attendance_log, metrics.PARSE_TABLE)
+CdataRequest.operation_log = _LazyField(  # type: ignore
+    'operation_log', None, _parse_operation_log, metrics.PARSE_TABLE)
+CdataRequest.attendance_photo_log = _LazyField(  # type: ignore
+    'attendance_photo_log', None, _parse_attendance_photo_log, metrics.PARSE_TABLE)
+
+
+def _photo_header(data: bytes) -> bytes:
+    return data[:_photo_split(data)[0]]
+
+
 def _from_maps(key: str, defaut: typing.Any,
                *args: typing.Mapping[str, typing.Any]) -> typing.Any:
     for d in args:
@@ -173,13 +567,21 @@ def _from_maps(key: str, defaut: typing.Any,
 def _extract_sn_version(req: _ParsedRequest) -> typing.Tuple[str, str]:
     pushver = req.params.get('pushver', 0.0)
     sn = _from_maps('SN', '', req.params)
+    if isinstance(sn, list):
+        # a repeated SN, the first one like the fallback below, so sn stays
+        # a str usable as a key of per device state
+        sn = sn[0]
 
     if not sn:
-        sn = req.req.get_full_url()
+        sn = req.req.get_full_url() if req.req is not None else req.query
         sn = (sn + 'SN=').split('SN=')[1].split('&')[0]
         if sn == '':
             sn = 'UNKNOWN'
-    return sn, pushver
+    return _serial_numbers(sn), pushver
+
+
+# every request of a device carries the same sn
+_serial_numbers = InternTable(10000)
 
 
 _info_map = collections.OrderedDict({
@@ -189,7 +591,24 @@ _info_map = collections.OrderedDict({
     'IPAddress': 'ip_address',
     'IsTFT': 'is_tft',
     'OEMVendor': 'oem_vendor',
-    'FPVersion': ''
+    'FPVersion': '',
+    # the rest is what snakecase gives, spelled out so that known keys
+    # never go through it
+    'TransactionCount': 'transaction_count',
+    'UserCount': 'user_count',
+    'MainTime': 'main_time',
+    'MaxFingerCount': 'max_finger_count',
+    'LockFunOn': 'lock_fun_on',
+    'MaxAttLogCount': 'max_att_log_count',
+    'DeviceName': 'device_name',
+    'AlgVer': 'alg_ver',
+    'FlashSize': 'flash_size',
+    'FreeFlashSize': 'free_flash_size',
+    'Language': 'language',
+    'DtFmt': 'dt_fmt',
+    'Platform': 'platform',
+    'Brightness': 'brightness',
+    'BackupDev': 'backup_dev',
 }
 )
 
@@ -220,19 +639,12 @@ def _fill_plain_info(info: str) -> Info:
 
 def _fill_info(info: str) -> Info:
     pd = _set_value_dict(info)
-    info_fileds = frozenset([f.name for f in da.fields(Info)])
+    resolve = _field_plan(Info, _info_map).resolve
     info_data = {}
     for key in pd.keys():
-        normal_key = key
-        if key[0] == '~':
-            normal_key = key[1:]
+        normal_key = resolve(key[1:] if key[:1] == '~' else key)
 
-        if normal_key in _info_map:
-            normal_key = _info_map[normal_key]
-        else:
-            normal_key = stringcase.snakecase(normal_key)
-
-        if normal_key in info_fileds:
+        if normal_key is not None:
             if normal_key == 'platform' and '_TFT' in pd[key]:
                 info_data['is_tft'] = True
             value = pd[key]
@@ -255,6 +667,46 @@ def _fill_info(info: str) -> Info:
     )
 
 
+INFO_CACHE_SIZE = 1024
+_INFO_MAX_DEVICES = 10000
+_info_max_devices = _INFO_MAX_DEVICES
+
+_cached_plain_info = functools.lru_cache(maxsize=INFO_CACHE_SIZE)(
+    _fill_plain_info
+)  # type: typing.Callable[[str], Info]
+_last_info = {}  # type: typing.Dict[str, typing.Tuple[str, Info]]
+
+
+def _device_info(sn: str, info: str) -> Info:
+    # devices repeat their INFO on every poll, the last one of each device is
+    # checked before the shared cache; Info is frozen so it can be shared
+    if not _info_max_devices:
+        return _cached_plain_info(info)
+    last = _last_info.get(sn)
+    if last is not None and last[0] == info:
+        return last[1]
+    parsed = _cached_plain_info(info)
+    if last is None and len(_last_info) >= _info_max_devices:
+        _last_info.pop(next(iter(_last_info)), None)
+    _last_info[sn] = (info, parsed)
+    return parsed
+
+
+def configure_info_cache(
+        maxsize: int = INFO_CACHE_SIZE,
+        max_devices: int = _INFO_MAX_DEVICES,
+) -> None:
+    # maxsize 0 disables both caches
+    global _cached_plain_info, _info_max_devices
+    _last_info.clear()
+    if maxsize > 0:
+        _cached_plain_info = functools.lru_cache(maxsize=maxsize)(_fill_plain_info)
+        _info_max_devices = max_devices
+    else:
+        _cached_plain_info = _fill_plain_info
+        _info_max_devices = 0
+
+
 def _set_value_dict(data: str) -> typing.Mapping[str, typing.Any]:
     d = {}
     for line in data.split('\t'):
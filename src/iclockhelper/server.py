@@ -0,0 +1,294 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import typing
+
+from .commands import CommandQueue
+from .journal import JournalWriter
+from .requests import CdataRequest, DeviceCmdRequest, DeviceInternTables, GetRequest
+from .sync import SyncTracker
+
+CDATA_PATH = '/iclock/cdata'
+GETREQUEST_PATH = '/iclock/getrequest'
+DEVICECMD_PATH = '/iclock/devicecmd'
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+class Sink:
+    # receives parsed device requests, override what you need
+    async def on_cdata(self, request: CdataRequest) -> None:
+        pass
+
+    async def on_getrequest(self, request: GetRequest) -> None:
+        pass
+
+    async def on_devicecmd(self, request: DeviceCmdRequest) -> None:
+        pass
+
+
+class AdmsServer:
+    def __init__(
+            self,
+            sinks: typing.Iterable[Sink] = (),
+            command_queue: typing.Optional[CommandQueue] = None,
+            sync_tracker: typing.Optional[SyncTracker] = None,
+            executor: typing.Optional[concurrent.futures.Executor] = None,
+            keep_alive_timeout: float = 75.0,
+            max_body_size: int = 64 * 1024 * 1024,
+            intern_tables: typing.Optional[DeviceInternTables] = None,
+            journal: typing.Optional[JournalWriter] = None,
+    ) -> None:
+        self.sinks = list(sinks)
+        self.command_queue = command_queue
+        self.sync_tracker = sync_tracker
+        # None runs parsing on the loop's default thread pool
+        self.executor = executor
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_body_size = max_body_size
+        self.intern_tables = intern_tables
+        # raw cdata uploads are appended once they parse, see JournalWriter
+        self.journal = journal
+
+    async def start(
+            self,
+            host: typing.Optional[str] = None,
+            port: int = 8080,
+            **kwargs: typing.Any,
+    ) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port, **kwargs)
+
+    async def shutdown(self) -> None:
+        # once the asyncio server is closed: commits what the journal and the
+        # sync store buffered
+        if self.journal is not None:
+            await self.run_in_executor(self.journal.close)
+        if self.sync_tracker is not None:
+            await self.run_in_executor(self.sync_tracker.store.flush)
+
+    async def handle(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+    ) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request_line = await asyncio.wait_for(
+                        _readline(reader, 400), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except HttpError as e:
+                    self._write_response(writer, e.status, '', False)
+                    break
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version, headers, body = await self._read_request(
+                        request_line, reader)
+                except HttpError as e:
+                    self._write_response(writer, e.status, '', False)
+                    break
+                keep_alive = _keep_alive(version, headers)
+                try:
+                    status, reply = 200, await self.dispatch(
+                        method, target, headers, body)
+                except HttpError as e:
+                    status, reply = e.status, ''
+                except Exception:
+                    # a failing sink must not leave the device without a reply
+                    logger.exception('error handling %s %s', method, target)
+                    status, reply = 500, ''
+                self._write_response(writer, status, reply, keep_alive)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(
+            self,
+            method: str,
+            target: str,
+            headers: typing.Dict[str, str],
+            body: bytes,
+    ) -> str:
+        path, _, query = target.partition('?')
+        if path == CDATA_PATH:
+            return await self.cdata(method, query, body)
+        if path == GETREQUEST_PATH:
+            return await self.getrequest(method, query, body)
+        if path == DEVICECMD_PATH:
+            return await self.devicecmd(method, query, body)
+        raise HttpError(404)
+
+    async def cdata(self, method: str, query: str, body: bytes) -> str:
+        cdata_req = await self.run_in_executor(self._parse_cdata, method, query, body)
+        if self.sync_tracker is not None and cdata_req.options:
+            return self.sync_tracker.options_reply(cdata_req.sn)
+        for sink in self.sinks:
+            await sink.on_cdata(cdata_req)
+        if self.sync_tracker is not None:
+            # only delivered records are marked seen
+            await self.run_in_executor(self.sync_tracker.acknowledge, cdata_req)
+        return 'OK'
+
+    def _parse_cdata(self, method: str, query: str, body: bytes) -> CdataRequest:
+        # runs on the executor, so journal commits and sync store queries
+        # don't block the loop
+        cdata_req = _parse(
+            CdataRequest.from_parts,
+            method, query, body, intern_tables=self.intern_tables)
+        if self.journal is not None and method == 'POST':
+            self.journal.append(method, CDATA_PATH, query, body)
+        if self.sync_tracker is not None and not cdata_req.options:
+            cdata_req = self.sync_tracker.filter(cdata_req)
+        return cdata_req
+
+    async def getrequest(self, method: str, query: str, body: bytes) -> str:
+        get_req = _parse(GetRequest.from_parts, method, query, body)
+        for sink in self.sinks:
+            await sink.on_getrequest(get_req)
+        if self.command_queue is not None:
+            return self.command_queue.pack(get_req.sn) or 'OK'
+        return 'OK'
+
+    async def devicecmd(self, method: str, query: str, body: bytes) -> str:
+        cmd_req = _parse(DeviceCmdRequest.from_parts, method, query, body)
+        if self.command_queue is not None:
+            self.command_queue.acknowledge_request(cmd_req)
+        for sink in self.sinks:
+            await sink.on_devicecmd(cmd_req)
+        return 'OK'
+
+    async def run_in_executor(
+            self,
+            func: typing.Callable[..., typing.Any],
+            *args: typing.Any,
+            **kwargs: typing.Any,
+    ) -> typing.Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _read_request(
+            self,
+            request_line: bytes,
+            reader: asyncio.StreamReader,
+    ) -> typing.Tuple[str, str, str, typing.Dict[str, str], bytes]:
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise HttpError(400)
+        method, target, version = parts
+
+        headers = {}  # type: typing.Dict[str, str]
+        while True:
+            line = await _readline(reader, 431)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, sep, value = line.decode('latin-1').partition(':')
+            if not sep:
+                raise HttpError(400)
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        else:
+            try:
+                length = int(headers.get('content-length', '0'))
+            except ValueError:
+                raise HttpError(400)
+            if length < 0:
+                raise HttpError(400)
+            if length > self.max_body_size:
+                raise HttpError(413)
+            body = await reader.readexactly(length) if length > 0 else b''
+        return method.upper(), target, version, headers, body
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []  # type: typing.List[bytes]
+        size = 0
+        while True:
+            try:
+                length = int((await _readline(reader, 400)).split(b';')[0], 16)
+            except ValueError:
+                raise HttpError(400)
+            if length == 0:
+                # trailers
+                while (await _readline(reader, 431)) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            size += length
+            if size > self.max_body_size:
+                raise HttpError(413)
+            chunks.append(await reader.readexactly(length))
+            await _readline(reader, 400)
+
+    def _write_response(
+            self,
+            writer: asyncio.StreamWriter,
+            status: int,
+            reply: str,
+            keep_alive: bool,
+    ) -> None:
+        body = reply.encode('utf-8')
+        writer.write(
+            'HTTP/1.1 {:d} {:s}\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Length: {:d}\r\n'
+            'Connection: {:s}\r\n'
+            '\r\n'.format(
+                status,
+                _REASONS.get(status, ''),
+                len(body),
+                'keep-alive' if keep_alive else 'close',
+            ).encode('latin-1') + body
+        )
+
+
+def _parse(
+        func: typing.Callable[..., typing.Any],
+        method: str,
+        query: str,
+        body: bytes,
+        **kwargs: typing.Any,
+) -> typing.Any:
+    # a body the parsers can't handle is the device's fault: 400, not 500
+    try:
+        return func(method, query, body, **kwargs)
+    except Exception as e:
+        logger.warning('malformed %s request %s', method, query, exc_info=True)
+        raise HttpError(400) from e
+
+
+def _keep_alive(version: str, headers: typing.Mapping[str, str]) -> bool:
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+async def _readline(reader: asyncio.StreamReader, status: int) -> bytes:
+    # a line over the StreamReader limit (64 KiB by default) is answered
+    # with `status` instead of dropping the connection
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HttpError(status)
@@ -0,0 +1,245 @@
+import abc
+import array
+import bisect
+import collections
+import sqlite3
+import threading
+import time
+import typing
+
+# per device, about 1 MB for a MemorySyncStore
+DEFAULT_MAX_SEEN = 100000
+# DedupIndex keeps its keys in up to this many sorted arrays
+_DEDUP_BLOCKS = 8
+# sqlite's default SQLITE_MAX_VARIABLE_NUMBER is 999
+_QUERY_CHUNK = 500
+
+
+class DedupIndex:
+    # set of 64 bit keys, the oldest are evicted once max_entries is reached;
+    # new keys go into a small set that is frozen into a sorted array('q')
+    # every max_entries / _DEDUP_BLOCKS keys, so most keys take 8 bytes
+    # instead of a set entry and an int, and whole arrays are evicted
+    def __init__(self, max_entries: int = DEFAULT_MAX_SEEN) -> None:
+        self.max_entries = max_entries
+        self._block_size = max(1, max_entries // _DEDUP_BLOCKS)
+        self._recent = set()  # type: typing.Set[int]
+        # oldest first
+        self._blocks = collections.deque()  # type: typing.Deque[array.array]
+        self._frozen = 0
+
+    def add(self, key: int) -> bool:
+        if key in self:
+            return False
+        self._recent.add(key)
+        if len(self._recent) >= self._block_size:
+            self._blocks.append(array.array('q', sorted(self._recent)))
+            self._frozen += len(self._recent)
+            self._recent = set()
+        while self._blocks and len(self) > self.max_entries:
+            self._frozen -= len(self._blocks.popleft())
+        return True
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._recent:
+            return True
+        for block in self._blocks:
+            i = bisect.bisect_left(block, key)
+            if i < len(block) and block[i] == key:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return self._frozen + len(self._recent)
+
+
+class SyncStore(abc.ABC):
+    @abc.abstractmethod
+    def get_stamp(self, sn: str, table: str) -> typing.Optional[str]:
+        pass
+
+    @abc.abstractmethod
+    def set_stamp(self, sn: str, table: str, stamp: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def unseen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        # for every key whether it wasn't seen before nor earlier in keys,
+        # without recording them
+        pass
+
+    @abc.abstractmethod
+    def add_seen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        # records keys, returns for every key whether it wasn't seen before
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemorySyncStore(SyncStore):
+    def __init__(self, max_seen: int = DEFAULT_MAX_SEEN) -> None:
+        self.max_seen = max_seen
+        self._stamps = {}  # type: typing.Dict[typing.Tuple[str, str], str]
+        self._seen = {}  # type: typing.Dict[str, DedupIndex]
+
+    def get_stamp(self, sn: str, table: str) -> typing.Optional[str]:
+        return self._stamps.get((sn, table))
+
+    def set_stamp(self, sn: str, table: str, stamp: str) -> None:
+        self._stamps[(sn, table)] = stamp
+
+    def unseen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        seen = self._seen.get(sn, ())  # type: typing.Container[int]
+        return _unseen(keys, seen)
+
+    def add_seen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        seen = self._seen.get(sn)
+        if seen is None:
+            seen = self._seen[sn] = DedupIndex(self.max_seen)
+        return [seen.add(key) for key in keys]
+
+
+class SqliteSyncStore(SyncStore):
+    # writes go into an open transaction that is committed every
+    # commit_every writes, by a background thread every commit_interval
+    # seconds, or on flush(); like MemorySyncStore at most max_seen keys are
+    # kept per device, the oldest are deleted first
+    def __init__(
+            self,
+            path: str,
+            commit_every: int = 1000,
+            commit_interval: float = 1.0,
+            max_seen: int = DEFAULT_MAX_SEEN,
+    ) -> None:
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.max_seen = max_seen
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS stamps ('
+            'sn TEXT NOT NULL, tbl TEXT NOT NULL, stamp TEXT NOT NULL, '
+            'PRIMARY KEY (sn, tbl)) WITHOUT ROWID')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            'sn TEXT NOT NULL, key INTEGER NOT NULL, seq INTEGER NOT NULL, '
+            'PRIMARY KEY (sn, key)) WITHOUT ROWID')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS seen_seq ON seen (sn, seq)')
+        self._conn.commit()
+        self._stamps = {
+            (sn, tbl): stamp for sn, tbl, stamp in
+            self._conn.execute('SELECT sn, tbl, stamp FROM stamps')
+        }  # type: typing.Dict[typing.Tuple[str, str], str]
+        # sn -> seq of its newest key, keys are numbered per device
+        self._last_seq = {}  # type: typing.Dict[str, int]
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._closed = threading.Event()
+        self._committer = None  # type: typing.Optional[threading.Thread]
+        if commit_interval > 0:
+            # quiet periods don't leave writes uncommitted
+            self._committer = threading.Thread(
+                target=self._commit_periodically, name='SqliteSyncStore-commit',
+                daemon=True)
+            self._committer.start()
+
+    def get_stamp(self, sn: str, table: str) -> typing.Optional[str]:
+        return self._stamps.get((sn, table))
+
+    def set_stamp(self, sn: str, table: str, stamp: str) -> None:
+        with self._lock:
+            if self._stamps.get((sn, table)) == stamp:
+                return
+            self._stamps[(sn, table)] = stamp
+            self._conn.execute(
+                'INSERT OR REPLACE INTO stamps (sn, tbl, stamp) VALUES (?, ?, ?)',
+                (sn, table, stamp))
+            self._written(1)
+
+    def unseen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        with self._lock:
+            return _unseen(keys, self._known(sn, keys))
+
+    def add_seen(self, sn: str, keys: typing.Sequence[int]) -> typing.List[bool]:
+        with self._lock:
+            flags = _unseen(keys, self._known(sn, keys))
+            new_keys = [key for key, is_new in zip(keys, flags) if is_new]
+            if new_keys:
+                last_seq = self._seq(sn)
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO seen (sn, key, seq) VALUES (?, ?, ?)',
+                    [(sn, key, last_seq + i) for i, key in enumerate(new_keys, 1)])
+                last_seq = self._last_seq[sn] = last_seq + len(new_keys)
+                if last_seq > self.max_seen:
+                    self._conn.execute(
+                        'DELETE FROM seen WHERE sn = ? AND seq <= ?',
+                        (sn, last_seq - self.max_seen))
+                self._written(len(new_keys))
+            return flags
+
+    def flush(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._committer is not None:
+            self._committer.join()
+        self.flush()
+        self._conn.close()
+
+    def _known(self, sn: str, keys: typing.Sequence[int]) -> typing.Set[int]:
+        known = set()  # type: typing.Set[int]
+        for start in range(0, len(keys), _QUERY_CHUNK):
+            chunk = list(set(keys[start:start + _QUERY_CHUNK]))
+            known.update(key for key, in self._conn.execute(
+                'SELECT key FROM seen WHERE sn = ? AND key IN ({:s})'.format(
+                    ','.join('?' * len(chunk))),
+                (sn, *chunk)))
+        return known
+
+    def _seq(self, sn: str) -> int:
+        last_seq = self._last_seq.get(sn)
+        if last_seq is None:
+            last_seq, = self._conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM seen WHERE sn = ?', (sn,)
+            ).fetchone()
+        return last_seq
+
+    def _commit_periodically(self) -> None:
+        while not self._closed.wait(self.commit_interval):
+            with self._lock:
+                if self._pending and time.monotonic() - self._last_commit \
+                        >= self.commit_interval:
+                    self._commit()
+
+    def _written(self, count: int) -> None:
+        self._pending += count
+        if self._pending >= self.commit_every or \
+                time.monotonic() - self._last_commit >= self.commit_interval:
+            self._commit()
+
+    def _commit(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+
+def _unseen(
+        keys: typing.Sequence[int],
+        seen: typing.Container[int],
+) -> typing.List[bool]:
+    batch = set()  # type: typing.Set[int]
+    flags = []
+    for key in keys:
+        is_new = key not in seen and key not in batch
+        if is_new:
+            batch.add(key)
+        flags.append(is_new)
+    return flags
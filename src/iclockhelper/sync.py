@@ -0,0 +1,92 @@
+import collections
+import hashlib
+import typing
+
+import dataclasses as da
+
+from .models import TableEnum, Transaction
+from .requests import CdataRequest
+from .store import DEFAULT_MAX_SEEN, MemorySyncStore, SyncStore
+
+DEFAULT_STAMP = '0'
+
+# sent after Stamp/OpStamp/PhotoStamp in the reply to GET /iclock/cdata?options=all
+DEFAULT_OPTIONS = collections.OrderedDict([
+    ('ErrorDelay', '30'),
+    ('Delay', '10'),
+    ('TransTimes', '00:00;14:05'),
+    ('TransInterval', '1'),
+    ('TransFlag', '1111000000'),
+    ('Realtime', '1'),
+    ('Encrypt', '0'),
+])
+
+_STAMP_KEYS = collections.OrderedDict([
+    (TableEnum.attlog, 'Stamp'),
+    (TableEnum.operlog, 'OpStamp'),
+    (TableEnum.attphoto, 'PhotoStamp'),
+])
+
+
+def transaction_key(transaction: Transaction) -> int:
+    # stable across processes, unlike hash()
+    server_datetime = transaction.server_datetime
+    key = '{:s}\t{:s}\t{:s}'.format(
+        transaction.pin,
+        server_datetime.isoformat() if server_datetime else '',
+        transaction.check_type,
+    ).encode('utf-8')
+    return int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), 'little', signed=True)
+
+
+class SyncTracker:
+    def __init__(
+            self,
+            options: typing.Optional[typing.Mapping[str, str]] = None,
+            store: typing.Optional[SyncStore] = None,
+            max_seen: int = DEFAULT_MAX_SEEN,
+    ) -> None:
+        self.options = collections.OrderedDict(DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        self.store = store if store is not None else MemorySyncStore(max_seen)
+
+    def stamp(self, sn: str, table: TableEnum) -> str:
+        return self.store.get_stamp(sn, table.value) or DEFAULT_STAMP
+
+    # filter() only drops transactions that were acknowledged before, call
+    # acknowledge() once the filtered request was delivered; a failed
+    # delivery then gets the same records again on the device's retry
+    def acknowledge(self, req: CdataRequest) -> None:
+        att_log = req.attendance_log
+        if att_log is not None and att_log.transactions:
+            self.store.add_seen(
+                req.sn, [transaction_key(t) for t in att_log.transactions])
+        stamp = req.operation_stamp if req.table == TableEnum.operlog else req.stamp
+        if req.table in _STAMP_KEYS and stamp:
+            self.store.set_stamp(req.sn, req.table.value, stamp)
+
+    def filter(self, req: CdataRequest) -> CdataRequest:
+        att_log = req.attendance_log
+        if att_log is None:
+            return req
+        transactions = list(att_log.transactions)
+        is_new = self.store.unseen(
+            req.sn, [transaction_key(t) for t in transactions])
+        transactions = [t for t, new in zip(transactions, is_new) if new]
+        if len(transactions) == len(att_log.transactions):
+            return req
+        return da.replace(
+            req, attendance_log=da.replace(att_log, transactions=transactions))
+
+    def process(self, req: CdataRequest) -> CdataRequest:
+        req = self.filter(req)
+        self.acknowledge(req)
+        return req
+
+    def options_reply(self, sn: str) -> str:
+        lines = ['GET OPTION FROM: {:s}'.format(sn)]
+        lines.extend('{:s}={:s}'.format(key, self.stamp(sn, table))
+                     for table, key in _STAMP_KEYS.items())
+        lines.extend('{:s}={:s}'.format(k, v) for k, v in self.options.items())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,60 @@
+import asyncio
+import io
+
+from iclockhelper.adapters import from_asgi, from_wsgi, read_asgi_body
+from iclockhelper.requests import CdataRequest, DeviceCmdRequest, GetRequest
+
+from .common import DeviceRequestBuilder
+
+_SN = 'SN1'
+_BODY = b'pin1\t2000-01-01 01:01:01\t0\t1\t0\t0'
+
+
+def test_from_parts_matches_from_req():
+    builder = DeviceRequestBuilder(_SN, 'http://localhost', '2.4.1')
+    req = builder.cdatarequest({'table': 'ATTLOG', 'Stamp': '9'}, _BODY)
+    query = req.get_full_url().split('?', 1)[1]
+    assert CdataRequest.from_req(req) == CdataRequest.from_parts('POST', query, _BODY)
+
+    req = builder.getrequest({'INFO': '2.4.1,1,2,3,10.0.0.1'})
+    query = req.get_full_url().split('?', 1)[1]
+    assert GetRequest.from_req(req) == GetRequest.from_parts('GET', query)
+
+    # an empty SN is dropped by the query parser, the raw query is scanned
+    assert 'UNKNOWN' == GetRequest.from_parts('GET', 'SN=&INFO=x').sn
+
+
+def test_from_wsgi():
+    cdata_req = from_wsgi({
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/iclock/cdata',
+        'QUERY_STRING': 'SN={:s}&table=ATTLOG&Stamp=9'.format(_SN),
+        'CONTENT_LENGTH': str(len(_BODY)),
+        'wsgi.input': io.BytesIO(_BODY + b'trailing'),
+    }, keep_raw=False)
+    assert isinstance(cdata_req, CdataRequest)
+    assert '9' == cdata_req.stamp
+    assert 'pin1' == cdata_req.attendance_log.transactions[0].pin
+    assert '' == cdata_req.attendance_log.transactions[0].raw
+    assert from_wsgi({'PATH_INFO': '/favicon.ico'}) is None
+
+
+def test_from_asgi():
+    messages = iter([
+        {'type': 'http.request', 'body': b'ID=1&Return=0', 'more_body': True},
+        {'type': 'http.request', 'body': b'&CMD=INFO'},
+    ])
+
+    async def receive():
+        return next(messages)
+
+    body = asyncio.run(read_asgi_body(receive))
+    cmd_req = from_asgi({
+        'type': 'http',
+        'method': 'POST',
+        'path': '/adms/iclock/devicecmd',
+        'query_string': 'SN={:s}'.format(_SN).encode('ascii'),
+    }, body)
+    assert isinstance(cmd_req, DeviceCmdRequest)
+    assert _SN == cmd_req.sn
+    assert 'INFO' == cmd_req.returns[0].cmd
@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+
+from iclockhelper.models import AttendanceLog
+
+np = pytest.importorskip('numpy')
+analytics = pytest.importorskip('iclockhelper.analytics')
+
+_BODY = '\n'.join([
+    'pin1\t2000-01-01 08:00:00\t0\t1\t0\t0',
+    'pin2\t2000-01-01 09:00:00\t0\t1\t0\t0',
+    'pin1\t2000-01-01 17:30:00\t1\t1\t0\t0',
+    'pin1\t2000-01-01 12:00:00\t1\t1\t0\t0',
+    'pin1\t2000-01-02 02:00:00\t1\t1\t0\t0',
+    'pin2\tbroken\t1\t1\t0\t0',
+])
+
+
+@pytest.mark.parametrize('source', [
+    _BODY,
+    _BODY.encode('ascii'),
+    AttendanceLog.from_str(_BODY),
+    AttendanceLog.from_str(_BODY, columnar=True),
+])
+def test_daily_summary(source):
+    summary = analytics.daily_summary(source)
+    assert [
+        ('pin1', datetime.date(2000, 1, 1), datetime.datetime(2000, 1, 1, 8),
+         datetime.datetime(2000, 1, 1, 17, 30), datetime.timedelta(hours=9.5), 3),
+        ('pin1', datetime.date(2000, 1, 2), datetime.datetime(2000, 1, 2, 2),
+         datetime.datetime(2000, 1, 2, 2), datetime.timedelta(0), 1),
+        ('pin2', datetime.date(2000, 1, 1), datetime.datetime(2000, 1, 1, 9),
+         datetime.datetime(2000, 1, 1, 9), datetime.timedelta(0), 1),
+    ] == sorted(summary.rows())
+
+
+def test_daily_summary_shift_and_day_start():
+    arrays = analytics.to_arrays(_BODY)
+    assert 5 == len(arrays)
+    # the 02:00 punch belongs to the night shift of the day before
+    summary = analytics.daily_summary(arrays, day_start=datetime.timedelta(hours=4))
+    assert [4, 1] == summary.punches.tolist()
+    # device clock in UTC, days counted at UTC-10
+    summary = analytics.daily_summary(arrays, shift=datetime.timedelta(hours=-10))
+    pin1 = summary.pins == 0
+    assert [datetime.date(1999, 12, 31), datetime.date(2000, 1, 1)] == \
+        summary.days[pin1].tolist()
+    assert [1, 3] == summary.punches[pin1].tolist()
+    assert datetime.datetime(1999, 12, 31, 22) == summary.first_in[0].tolist()
+    assert 0 == len(analytics.daily_summary(''))
@@ -0,0 +1,54 @@
+import pickle
+
+from iclockhelper import parse_many
+from iclockhelper.models import TableEnum
+from iclockhelper.requests import CdataRequest, _CdataPayload
+
+from .common import DeviceRequestBuilder
+
+
+def _requests(count: int):
+    builder = DeviceRequestBuilder(
+        sn='SN_BATCH',
+        iclock_host='http://localhost',
+        fw_version='2.4.0',
+    )
+    return [
+        builder.cdatarequest(
+            query={'table': TableEnum.attlog.value, 'Stamp': str(i)},
+            body='pin{:d}\t2000-01-01 01:01:{:02d}\t0\t1'.format(i, i % 60).encode(
+                'ascii'),
+        )
+        for i in range(count)
+    ]
+
+
+def test_parse_many_keeps_input_order():
+    requests = _requests(20)
+    results = parse_many(requests, workers=2, chunksize=3)
+
+    assert [str(i) for i in range(20)] == [r.stamp for r in results]
+    for req, result in zip(requests, results):
+        expected = CdataRequest.from_req(req, keep_raw=False)
+        assert expected.attendance_log.transactions == \
+            result.attendance_log.transactions
+        assert '' == result.body
+        assert result == pickle.loads(pickle.dumps(result))
+
+
+def test_parse_many_url_body_pairs():
+    requests = _requests(2)
+    pairs = [(req.get_full_url(), req.data) for req in requests]
+    assert parse_many(requests, workers=1, keep_raw=True) == \
+        parse_many(pairs, workers=1, keep_raw=True)
+
+
+def test_parse_many_never_decodes_body(monkeypatch):
+    def decoded(payload):
+        raise AssertionError('body decoded')
+
+    monkeypatch.setattr(_CdataPayload, 'decoded', decoded)
+    result, = parse_many(_requests(1), workers=1)
+    assert '' == result.body
+    assert 1 == len(result.attendance_log.transactions)
+    assert result._payload is None
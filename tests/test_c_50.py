@@ -1,4 +1,7 @@
+import base64
 import datetime
+import io
+import pickle
 import typing
 import unittest
 
@@ -14,7 +17,13 @@ from iclockhelper.models import (
     Transaction,
     User
 )
-from iclockhelper.requests import CdataRequest, GetRequest
+from iclockhelper.requests import (
+    CdataRequest,
+    DeviceInternTables,
+    EncodingStrategy,
+    GetRequest,
+    configure_info_cache
+)
 
 from .common import DeviceRequestBuilder
 
@@ -320,6 +329,97 @@ class ModelC50Test(unittest.TestCase):
                 actual,
             )
 
+    def test_cdata_attlog_lazy(self):
+        base_datetime = datetime.datetime(year=2000, month=1, day=1, hour=1, minute=1,
+                                          second=0)
+        body = _create_many_trans_body([
+            Transaction(
+                pin='pin1',
+                server_datetime=base_datetime,
+                raw=''
+            ),
+        ])
+        req = self.req_builder.cdatarequest(
+            query={'table': TableEnum.attlog.value, 'Stamp': _STAMP},
+            body=body.encode('ascii'),
+        )
+        cdata_req = CdataRequest.from_req(req, lazy=True)
+        self.assertEqual(_STAMP, cdata_req.stamp)
+        self.assertNotIn('body', vars(cdata_req))
+        self.assertNotIn('attendance_log', vars(cdata_req))
+
+        self.assertIsNone(cdata_req.operation_log)
+        self.assertEqual(1, len(cdata_req.attendance_log.transactions))
+        self.assertIs(cdata_req.attendance_log, cdata_req.attendance_log)
+        self.assertEqual(body, cdata_req.body)
+        self.assertEqual(CdataRequest.from_req(req), cdata_req)
+
+        # without keep_raw the log comes from the bytes, body stays undecoded
+        cdata_req = CdataRequest.from_req(req, keep_raw=False)
+        self.assertIn('attendance_log', vars(cdata_req))
+        self.assertNotIn('body', vars(cdata_req))
+        self.assertEqual('', cdata_req.attendance_log.transactions[0].raw)
+        self.assertEqual(body, cdata_req.body)
+
+    def test_cdata_operlog_encoding(self):
+        user = User(
+            pin='pin1',
+            name='张三',
+            password='',
+            card='',
+            group='1',
+            tz='0',
+            privileges='0',
+            raw=''
+        )
+        req = self.req_builder.cdatarequest(
+            query={'table': TableEnum.operlog.value, 'OpStamp': _OP_STAMP},
+            body=_create_many_user_body([user]).encode('gb18030'),
+        )
+        strategy = EncodingStrategy(encodings=('utf-8', 'gb18030'))
+        cdata_req = CdataRequest.from_req(req, encoding_strategy=strategy)
+        self.assertEqual('gb18030', cdata_req.encoding)
+        self.assertEqual('gb18030', strategy.hint(_SN))
+        self.assertEqual(user.name, cdata_req.operation_log.users[0].name)
+
+        ascii_req = self.req_builder.cdatarequest(
+            query={'table': TableEnum.attlog.value, 'Stamp': _STAMP},
+            body=b'pin1',
+        )
+        self.assertEqual('ascii', CdataRequest.from_req(ascii_req).encoding)
+
+    def test_cdata_intern_tables(self):
+        tables = DeviceInternTables()
+        pins = []
+        for _ in range(2):
+            req = self.req_builder.cdatarequest(
+                query={'table': TableEnum.attlog.value, 'Stamp': _STAMP},
+                body='pin1\t2000-01-01 01:01:01\t0\t1\t0\t0'.encode('ascii'),
+            )
+            cdata_req = CdataRequest.from_req(req, intern_tables=tables)
+            pins.append(cdata_req.attendance_log.transactions[0].pin)
+        self.assertIs(pins[0], pins[1])
+        # pin1, 0 and 1
+        self.assertEqual(3, len(tables.get(_SN)))
+
+    def test_cdata_field_order(self):
+        # positional construction of the original fields keeps working
+        self.assertEqual([
+            'sn', 'push_version', 'method', 'pin', 'save', 'body', 'stamp',
+            'operation_stamp', 'table', 'attendance_log', 'operation_log',
+            'attendance_photo_log',
+        ], [f.name for f in da.fields(CdataRequest)][:12])
+
+    def test_repeated_sn(self):
+        body = 'pin1\t2000-01-01 01:01:01\t0\t1\t0\t0'.encode('ascii')
+        cdata_req = CdataRequest.from_parts(
+            'POST', 'SN=A&SN=B&table=ATTLOG', body,
+            intern_tables=DeviceInternTables())
+        self.assertEqual('A', cdata_req.sn)
+        self.assertEqual('pin1', cdata_req.attendance_log.transactions[0].pin)
+        get_req = GetRequest.from_parts('GET', 'SN=A&SN=B&INFO=2.4.0,1,1,1', b'')
+        self.assertEqual('A', get_req.sn)
+
     def test_fdata_attlog(self):
         base_datetime = datetime.datetime(year=2000, month=1, day=1, hour=1, minute=1,
                                           second=0)
@@ -349,6 +449,52 @@ class ModelC50Test(unittest.TestCase):
             expected,
             actual,
         )
+        self.assertEqual(body, cdata_req.body)
+        # the pin of the body goes in front of it when not in the query
+        raw = '20000101010100-pin1.jpg' + body
+        self.assertEqual(raw, cdata_req.attendance_photo_log.raw)
+        self.assertEqual(raw, AttendancePhotoLog.from_request_pin('', body).raw)
+        self.assertEqual(b'data', bytes(cdata_req.attendance_photo_log.image))
+
+    def test_fdata_attlog_image(self):
+        image = bytes(range(256)) * 10
+        header = 'PIN=20000101010100-pin1.jpg\nSN={:s}\nsize={:d}\nCMD=uploadphoto\0'
+        body = header.format(_SN, len(image)).encode('ascii') + base64.b64encode(image)
+        req = self.req_builder.cdatarequest(
+            query={'table': TableEnum.attphoto.value, 'Stamp': '9999'},
+            body=body,
+        )
+        photo = CdataRequest.from_req(req).attendance_photo_log
+        self.assertEqual('pin1', photo.pin)
+        self.assertEqual(image, b''.join(photo.iter_image(chunk_size=100)))
+        out = io.BytesIO()
+        self.assertEqual(len(image), photo.write_image(out))
+        self.assertEqual(image, out.getvalue())
+        self.assertEqual(photo.data[1:], photo.image.tobytes().decode('ascii'))
+        self.assertEqual(photo, pickle.loads(pickle.dumps(photo)))
+
+        # line wrapped base64, e.g. 76 characters per line
+        image = bytes(range(256)) * 400
+        for chunk_size in (1000, 48 * 1024):
+            body = header.format(_SN, len(image)).encode('ascii') + \
+                base64.encodebytes(image)
+            photo = CdataRequest.from_req(self.req_builder.cdatarequest(
+                query={'table': TableEnum.attphoto.value, 'Stamp': '9999'},
+                body=body,
+            )).attendance_photo_log
+            self.assertEqual(image, b''.join(photo.iter_image(chunk_size)))
+
+    def test_fdata_attlog_header_encoding(self):
+        # utf-8 also decodes as gb18030, only the strategy knows which it is
+        header = 'PIN=20000101010100-пин.jpg\nSN={:s}\nsize=4\nCMD=uploadphoto\0'
+        req = self.req_builder.cdatarequest(
+            query={'table': TableEnum.attphoto.value, 'Stamp': '9999'},
+            body=header.format(_SN).encode('utf-8') + b'data',
+        )
+        cdata_req = CdataRequest.from_req(
+            req, encoding_strategy=EncodingStrategy(encodings=('utf-8', 'gb18030')))
+        self.assertEqual('utf-8', cdata_req.encoding)
+        self.assertEqual('пин', cdata_req.attendance_photo_log.pin)
 
     def test_getreq(self):
         req = self.req_builder.getrequest(
@@ -369,6 +515,25 @@ class ModelC50Test(unittest.TestCase):
         self.assertEqual(_FP_COUNT, get_req.info.fp_count)
         self.assertEqual(_TRANS_COUNT, get_req.info.transaction_count)
 
+    def test_getreq_info_cache(self):
+        info = 'FWVersion={:s}\t~MaxAttLogCount=3\tPlatform=ZMM_TFT\tFoo=bar'.format(
+            _FW_VERSION)
+        first, second = [
+            GetRequest.from_req(self.req_builder.getrequest(query={'INFO': info}))
+            for _ in range(2)
+        ]
+        self.assertIs(first.info, second.info)
+        self.assertEqual(30000, first.info.max_att_log_count)
+        self.assertTrue(first.info.is_tft)
+        configure_info_cache(0)
+        try:
+            third = GetRequest.from_req(
+                self.req_builder.getrequest(query={'INFO': info}))
+        finally:
+            configure_info_cache()
+        self.assertIsNot(first.info, third.info)
+        self.assertEqual(first.info, third.info)
+
     def test_devpostreq(self):
         self.assertTrue(True)
 
@@ -0,0 +1,40 @@
+from iclockhelper.commands import CommandQueue
+from iclockhelper.requests import DeviceCmdRequest
+
+from .common import DeviceRequestBuilder
+
+
+def test_pack_respects_size_limit():
+    queue = CommandQueue(max_response_size=40)
+    sns = ['SN{:d}'.format(i) for i in range(3)]
+    cmds = ['DATA USER PIN={:d}\tName=user{:d}'.format(i, i) for i in range(3)]
+    queue.push_many(sns, cmds)
+
+    first = queue.pack('SN0')
+    assert 'C:1:{:s}\n'.format(cmds[0]) == first
+    assert 2 == queue.pending('SN0')
+    rest = queue.pack('SN0', max_size=1024)
+    assert 2 == rest.count('\n')
+    assert 0 == queue.pending('SN0')
+    assert '' == queue.pack('SN0')
+    assert 3 == queue.pending('SN2')
+
+
+def test_acknowledge_devicecmd_returns():
+    queue = CommandQueue()
+    info = queue.push('SN0', 'INFO')
+    check = queue.push('SN0', 'CHECK')
+    queue.pack('SN0')
+    assert 2 == len(queue.in_flight('SN0'))
+
+    builder = DeviceRequestBuilder(sn='SN0', iclock_host='http://localhost',
+                                   fw_version='2.4.0')
+    req = builder.postcmdrequest(str(check.id), 'CHECK', '0')
+    acked = queue.acknowledge_request(DeviceCmdRequest.from_req(req))
+
+    assert [check] == [command for command, _ in acked]
+    assert '0' == acked[0][1].return_code
+    assert [info] == queue.in_flight()
+
+    assert 1 == queue.requeue('SN0')
+    assert 'C:{:d}:INFO\n'.format(info.id) == queue.pack('SN0')
@@ -0,0 +1,53 @@
+import csv
+import datetime
+import io
+import json
+
+from iclockhelper.export import to_columns, write_csv, write_ndjson
+from iclockhelper.models import AttendanceLog, OperationLog
+
+_ATTLOG = AttendanceLog.from_str(
+    'pin1\t2000-01-01 01:01:05\t0\t1\t0\t0\n'
+    'pin2\tbroken\t1\t1\t0\t0'
+)
+_OPERLOG = OperationLog.from_str(
+    'OPLOG 3\t0\t2000-01-01 01:01:01\t51\t0\t0\t0\n'
+    'USER PIN=1\tName=name\tPri=0\tPasswd=\tCard=\tGrp=1\tTZ=0'
+)
+
+
+def test_write_csv():
+    out = io.StringIO()
+    count = write_csv(_ATTLOG.transactions, out, fields=['pin', 'server_datetime'],
+                      batch_size=1)
+    assert 2 == count
+    assert [
+        ['pin', 'server_datetime'],
+        ['pin1', '2000-01-01 01:01:05'],
+        ['pin2', ''],
+    ] == list(csv.reader(io.StringIO(out.getvalue())))
+
+
+def test_write_ndjson():
+    out = io.StringIO()
+    write_ndjson(_OPERLOG.operations + _OPERLOG.users, out)
+    operation, user = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert '3' == operation['operation']
+    assert '51' == operation['alarm']
+    assert '2000-01-01 01:01:01' == operation['server_datetime']
+    assert 'name' == user['name']
+
+
+def test_to_columns():
+    columns = to_columns(_ATTLOG.transactions)
+    assert ['pin1', 'pin2'] == columns['pin']
+    assert [datetime.datetime(2000, 1, 1, 1, 1, 5), None] == \
+        columns['server_datetime']
+    assert {} == to_columns([])
+
+
+def test_to_columns_columnar():
+    columnar = AttendanceLog.from_str(_ATTLOG.raw, columnar=True)
+    assert to_columns(_ATTLOG.transactions) == to_columns(columnar.transactions)
+    assert to_columns(_ATTLOG.transactions, render_datetime=True) == \
+        to_columns(columnar.transactions, render_datetime=True)
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import iclockhelper
+
+
+def _imported_modules(statement):
+    # module names from `python -X importtime`, which reports to stderr
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(iclockhelper.__file__))] +
+        env.get('PYTHONPATH', '').split(os.pathsep))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE, env=env, universal_newlines=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_time():
+    modules = _imported_modules('import iclockhelper')
+    assert 'iclockhelper' in modules
+    assert 'iclockhelper.models' not in modules
+
+    modules = _imported_modules(
+        'from iclockhelper import CdataRequest, GetRequest, TableEnum')
+    slow = {'pkg_resources', 'stringcase', 'urllib.request', 'importlib.metadata'}
+    assert set() == slow & set(modules)
+
+
+def test_lazy_exports():
+    namespace = {}
+    exec('from iclockhelper import *', namespace)
+    assert set(iclockhelper.__all__) <= set(namespace)
+    assert iclockhelper.CdataRequest is iclockhelper.requests.CdataRequest
+    assert 'parse_many' in dir(iclockhelper)
+    assert isinstance(iclockhelper.__version__, str)
+    with pytest.raises(AttributeError):
+        iclockhelper.missing
+    assert 'Transaction' in vars(iclockhelper.models)
+    assert iclockhelper.store.SqliteSyncStore
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+import pytest
+
+from iclockhelper import journal
+
+from iclockhelper.journal import (
+    FSYNC_ALWAYS,
+    FSYNC_BATCH,
+    FSYNC_NEVER,
+    HEADER_SIZE,
+    JournalError,
+    JournalReader,
+    JournalWriter,
+    build_index,
+    index_path,
+    pack_record,
+    read_index
+)
+from iclockhelper.requests import CdataRequest
+
+_CDATA = '/iclock/cdata'
+
+
+def _body(i):
+    return 'pin{:d}\t2000-01-01 01:01:01\t0\t1\t0\t0'.format(i).encode('ascii')
+
+
+def _write(path, count):
+    with open(path, 'wb') as f:
+        for i in range(count):
+            query = 'SN=SN{:d}&table=ATTLOG&Stamp={:d}'.format(i % 2, i)
+            f.write(pack_record('POST', _CDATA, query, _body(i)))
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / 'day.journal')
+    _write(path, 5)
+    with JournalReader(path) as reader:
+        assert 5 == len(reader)
+        record = reader[3]
+        assert ('POST', _CDATA, _body(3)) == (record.method, record.path, record.body)
+        cdata_req = record.parse(keep_raw=False)
+        assert isinstance(cdata_req, CdataRequest)
+        assert ('SN1', '3') == (cdata_req.sn, cdata_req.stamp)
+        assert 'pin3' == cdata_req.attendance_log.transactions[0].pin
+        assert [1, 3] == [r.number for r in reader.records(sn='SN1')]
+        assert 4 == reader[-1].number
+
+    assert 5 == build_index(path)
+    offsets = read_index(index_path(path))
+    assert 0 == offsets[0]
+    with JournalReader(path) as reader:
+        assert list(offsets) == list(reader.offsets)
+
+
+def test_replay_index_lags_and_torn_tail(tmp_path):
+    path = str(tmp_path / 'day.journal')
+    _write(path, 2)
+    build_index(path)
+    with open(path, 'ab') as f:
+        f.write(pack_record('POST', _CDATA, 'SN=SN9&table=ATTLOG', _body(9)))
+        # crashed half way through a write
+        f.write(pack_record('POST', _CDATA, 'SN=SN9&table=ATTLOG', _body(10))[:-3])
+    with JournalReader(path) as reader:
+        assert 3 == len(reader)
+        assert _body(9) == reader[2].body
+
+    # an index of a journal that was rewritten shorter
+    _write(path, 1)
+    with JournalReader(path) as reader:
+        assert 1 == len(reader)
+
+
+def test_replay_checksum(tmp_path):
+    path = str(tmp_path / 'day.journal')
+    _write(path, 1)
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + 10)
+        f.write(b'X')
+    with JournalReader(path) as reader:
+        with pytest.raises(JournalError):
+            reader[0]
+    with JournalReader(path, verify=False) as reader:
+        assert reader[0].body
+
+    open(path, 'wb').close()
+    with JournalReader(path) as reader:
+        assert 0 == len(reader)
+
+
+def test_writer_group_commit(tmp_path):
+    path = str(tmp_path / 'day.journal')
+    writer = JournalWriter(path, fsync=FSYNC_NEVER, commit_every=3,
+                           commit_interval=3600)
+    for i in range(4):
+        assert i == writer.append('POST', _CDATA, 'SN=SN1&table=ATTLOG', _body(i))
+    # the fourth record waits for the next commit
+    with JournalReader(path) as reader:
+        assert 3 == len(reader)
+    writer.close()
+    assert 4 == len(read_index(index_path(path)))
+
+    cdata_req = CdataRequest.from_parts(
+        'POST', 'SN=SN2&table=ATTLOG&Stamp=7', _body(9))
+    with open(path, 'ab') as f:
+        f.write(b'torn')
+    with JournalWriter(path, fsync=FSYNC_ALWAYS) as writer:
+        assert 4 == len(writer)
+        assert 4 == writer.append_cdata(cdata_req, _body(9))
+        with JournalReader(path) as reader:
+            assert 5 == len(reader)
+            replayed = reader[4].parse()
+            assert cdata_req == replayed
+            assert ('SN2', '7') == (replayed.sn, replayed.stamp)
+
+    with pytest.raises(ValueError):
+        JournalWriter(path, fsync='sometimes')
+
+
+def test_writer_flushes_when_idle(tmp_path):
+    path = str(tmp_path / 'day.journal')
+    with JournalWriter(path, fsync=FSYNC_NEVER, commit_interval=0.01) as writer:
+        writer.append('POST', _CDATA, 'SN=SN1&table=ATTLOG', _body(0))
+        deadline = time.monotonic() + 5
+        while os.path.getsize(path) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with JournalReader(path) as reader:
+            assert 1 == len(reader)
+
+
+def test_writer_batch_shares_fsync(tmp_path, monkeypatch):
+    fsyncs = []
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.01)
+        fsync(fd)
+
+    monkeypatch.setattr(journal.os, 'fsync', slow_fsync)
+    path = str(tmp_path / 'day.journal')
+    visible = []
+    with JournalWriter(path, fsync=FSYNC_BATCH) as writer:
+        def append(i):
+            number = writer.append('POST', _CDATA, 'SN=SN1&table=ATTLOG', _body(i))
+            with JournalReader(path) as reader:
+                visible.append(number < len(reader))
+
+        threads = [threading.Thread(target=append, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # every append was on disk before it returned
+    assert [True] * 16 == visible
+    with JournalReader(path) as reader:
+        assert 16 == len(reader)
+    # journal and index per commit, fewer commits than appends
+    assert len(fsyncs) < 2 * 16
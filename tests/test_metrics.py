@@ -0,0 +1,50 @@
+from iclockhelper import metrics
+from iclockhelper.models import AlarmEnum
+from iclockhelper.requests import CdataRequest, EncodingStrategy, GetRequest
+
+from .common import DeviceRequestBuilder
+
+_BUILDER = DeviceRequestBuilder('SN1', 'http://localhost', '2.4.1')
+
+
+def test_disabled_by_default():
+    assert metrics.current is None
+    req = CdataRequest.from_req(_BUILDER.cdatarequest(
+        {'table': 'ATTLOG', 'Stamp': '1'}, b'1\t2000-01-01 01:01:01\t0\t1\t0\t0'))
+    assert 1 == len(req.attendance_log.transactions)
+
+
+def test_cdata_stages_and_counters():
+    counters = metrics.enable(metrics.Counters())
+    try:
+        body = b'1\t2000-01-01 01:01:01\t0\t1\t0\t0\n2\t2000-01-01 01:01:02\t0\t1\t0\t0'
+        CdataRequest.from_req(_BUILDER.cdatarequest(
+            {'table': 'ATTLOG', 'Stamp': '1'}, body))
+        GetRequest.from_req(_BUILDER.getrequest({'INFO': '2.4.1,1,1,1'}))
+        CdataRequest.from_req(_BUILDER.cdatarequest(
+            {'table': 'OPERLOG', 'OpStamp': '1'},
+            b'OPLOG 999\t0\t2000-01-01 01:01:01\t0\t0\t0\t0'))
+        CdataRequest.from_req(_BUILDER.cdatarequest({'table': 'NOPE'}, b'x'))
+        AlarmEnum('no such alarm')
+        EncodingStrategy(('utf-8', 'gb18030')).decode('ид'.encode('gb18030'), 'SN1')
+        CdataRequest.from_parts(
+            'POST', 'SN=SN2&table=ATTLOG',
+            'ид\t2000-01-01 01:01:01\t0\t1\t0\t0'.encode('gb18030'),
+            keep_raw=False, encoding_strategy=EncodingStrategy(('utf-8', 'gb18030')))
+    finally:
+        metrics.disable()
+
+    assert len(body) == counters.counters[(metrics.BYTES_IN, 'SN1', 'ATTLOG')]
+    assert 2 == counters.counters[(metrics.RECORDS_OUT, 'SN1', 'ATTLOG')]
+    # the request being parsed, nothing outside of one
+    assert 1 == counters.counters[(metrics.UNKNOWN_ENUM, 'SN1', 'OPERLOG')]
+    assert 1 == counters.counters[(metrics.UNKNOWN_ENUM, 'SN1', '')]
+    assert 1 == counters.counters[(metrics.UNKNOWN_ENUM, '', '')]
+    assert 3 == counters.total(metrics.UNKNOWN_ENUM)
+    assert 1 == counters.counters[(metrics.DECODE_FALLBACK, 'SN1', '')]
+    assert 1 == counters.counters[(metrics.DECODE_FALLBACK, 'SN2', 'ATTLOG')]
+    assert 0 == counters.total(metrics.DECODE_FAILURE)
+    assert 4 == counters.timings[(metrics.PARSE_URL, 'SN1', '')][0]
+    assert 1 == counters.timings[(metrics.DECODE, 'SN1', 'ATTLOG')][0]
+    assert 1 == counters.timings[(metrics.PARSE_TABLE, 'SN1', 'ATTLOG')][0]
+    assert 1 == counters.timings[(metrics.PARSE_INFO, 'SN1', '')][0]
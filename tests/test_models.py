@@ -1,8 +1,27 @@
+import collections
 import datetime
+import io
+import tracemalloc
+import typing
 
+import dataclasses as da
+
+import pytest
 import pytz as pytz
+import stringcase
 
-from iclockhelper.models import ServerDatetimeMixin
+from iclockhelper import models
+from iclockhelper.models import (
+    DATETIME_FORMAT,
+    AttendanceLog,
+    DeviceTimezone,
+    InternTable,
+    OperationLog,
+    ServerDatetimeMixin,
+    Transaction,
+    User,
+    configure_datetime_cache
+)
 
 
 def test_server_datetime_mixin():
@@ -23,3 +42,251 @@ def test_server_datetime_mixin():
         assert getattr(base_datetime, f) == getattr(actual_time, f)
 
     assert actual_time.tzinfo == gmt
+
+
+def test_attendance_log_iter_stream():
+    body = "\n".join(
+        "pin{:d}\t2000-01-01 01:01:{:02d}\t0\t1\t0\t0".format(i, i % 60)
+        for i in range(50)
+    ).encode('ascii')
+    expected = AttendanceLog.from_str(body.decode('ascii')).transactions
+
+    actual = list(AttendanceLog.iter_stream(io.BytesIO(body), chunk_size=7))
+    assert expected == actual
+
+    limited = list(AttendanceLog.iter_stream(body + b'\ngarbage', length=len(body)))
+    assert expected == limited
+
+    # the empty last line is a transaction too, as in from_str
+    trailing = list(AttendanceLog.iter_stream(body + b'\n'))
+    assert AttendanceLog.from_str(body.decode('ascii') + '\n').transactions == trailing
+    assert Transaction.from_str('') == trailing[-1]
+    assert [Transaction.from_str('')] == list(AttendanceLog.iter_stream(b''))
+
+    body = 'пин\t2000-01-01 01:01:01\t0\t1\t0\t0'.encode('utf-8')
+    assert ['пин'] == [t.pin for t in AttendanceLog.iter_stream(
+        body, encoding='utf-8')]
+
+
+def test_parse_datetime_matches_strptime():
+    values = [
+        '2000-01-01 01:01:01',
+        '2020-02-29 23:59:59',
+        '2019-02-29 23:59:59',
+        '2000-01- 1 01:01:01',
+        '2000-1-1 1:1:1',
+        '2000-13-01 01:01:01',
+        '2000-01-01T01:01:01',
+        '',
+        'garbage',
+    ]
+    try:
+        for maxsize in (0, 16):
+            configure_datetime_cache(maxsize)
+            for value in values:
+                try:
+                    expected = datetime.datetime.strptime(value, DATETIME_FORMAT)
+                except ValueError:
+                    expected = None
+                assert expected == models._parse_datetime(value)
+    finally:
+        # later tests expect the default cache even when this one fails
+        configure_datetime_cache()
+
+
+def test_user_from_str_field_plan(monkeypatch):
+    line = 'PIN=1\tName=name\tPri=0\tPasswd=\tCard=[0000]\tGrp=1\tTZ=0' \
+           '\tVerify=0\tViceCard=\tUnknownKey=1'
+    expected = User(pin='1', name='name', privileges='0', password='',
+                    card='[0000]', group='1', tz='0', verify='0', vice_card='',
+                    raw=line)
+    assert expected == User.from_str(line)
+
+    calls = []
+    snakecase = stringcase.snakecase
+    monkeypatch.setattr(stringcase, 'snakecase',
+                        lambda key: calls.append(key) or snakecase(key))
+    assert expected == User.from_str(line)
+    assert [] == calls
+
+
+def test_attendance_log_columnar():
+    body = "\n".join([
+        "pin1\t2000-01-01 01:01:05\t0\t1\t0\t0",
+        "pin2\t2000-01-01 01:01:10\t1\t1\t0\t0",
+        "pin1\tbroken\t0",
+        "pin1\t2000-01-02 01:01:10\t1\t15\t0\t0",
+    ])
+    expected = AttendanceLog.from_str(body)
+    actual = AttendanceLog.from_str(body, columnar=True)
+
+    assert expected == actual
+    transactions = actual.transactions
+    assert 4 == len(transactions)
+    assert expected.transactions[-1] == transactions[-1]
+    assert expected.transactions[1:3] == transactions[1:3]
+    assert ['pin1', 'pin2'] == transactions.pins.values
+    assert models.NO_EPOCH == transactions.epoch_seconds[2]
+    assert 946688465 == transactions.epoch_seconds[0]
+
+    intern = InternTable()
+    shared = intern('pin1')
+    columns = AttendanceLog.from_str(
+        body, columnar=True, keep_raw=False, intern=intern).transactions
+    assert AttendanceLog.from_str(body, keep_raw=False) == AttendanceLog(
+        raw=body, transactions=list(columns))
+    assert [''] * 4 == columns.column('raw')
+    assert shared is columns.pins[0]
+
+
+@da.dataclass(frozen=True)
+class _DictTransaction:
+    server_datetime: typing.Optional[datetime.datetime]
+    pin: str
+    raw: str
+    check_type: str = ''
+    verify_code: str = ''
+    work_code: str = ''
+    reserved: str = ''
+
+
+def _bytes_per_record(build: typing.Callable[[], typing.Sequence]) -> float:
+    tracemalloc.start()
+    try:
+        records = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size / len(records)
+
+
+def test_memory_per_record(record_property):
+    body = "\n".join(
+        "pin{:d}\t2000-01-01 01:01:{:02d}\t0\t1\t0\t0".format(i % 100, i % 60)
+        for i in range(10000)
+    )
+    parsed = AttendanceLog.from_str(body, keep_raw=False).transactions
+    values = [[getattr(t, f.name) for f in da.fields(t)] for t in parsed]
+
+    dict_based = _bytes_per_record(lambda: [_DictTransaction(*v) for v in values])
+    slotted = _bytes_per_record(lambda: [Transaction(*v) for v in values])
+    with_raw = _bytes_per_record(lambda: AttendanceLog.from_str(body).transactions)
+    without_raw = _bytes_per_record(
+        lambda: AttendanceLog.from_str(body, keep_raw=False).transactions)
+
+    # bytes per record in every run's report, e.g. pytest --junitxml
+    sizes = collections.OrderedDict([
+        ('dict', dict_based),
+        ('slots', slotted),
+        ('parsed_with_raw', with_raw),
+        ('parsed_without_raw', without_raw),
+    ])
+    for name, size in sizes.items():
+        record_property('bytes_per_record_' + name, round(size))
+    assert slotted < dict_based, sizes
+    assert without_raw < with_raw, sizes
+
+
+def test_from_bytes_matches_from_str(monkeypatch):
+    monkeypatch.setattr(models, '_LINES_CHUNK_SIZE', 16)
+    att_body = "\n".join(
+        "pin{:d}\t2000-01-01 01:01:{:02d}\t0\t1".format(i % 3, i % 60)
+        for i in range(20)
+    )
+    att_body += "\n李四\t2000-01-01 01:01:01\t0\t1"
+    for data in (att_body.encode('gb18030'), memoryview(att_body.encode('gb18030'))):
+        assert AttendanceLog.from_str(att_body) == AttendanceLog.from_bytes(data)
+
+    # the body once, then every distinct field value and timestamp once
+    decoded = []
+    text = models._FieldDecoder.text
+    monkeypatch.setattr(models._FieldDecoder, 'text',
+                        lambda self, value: decoded.append(value) or text(self, value))
+    AttendanceLog.from_bytes(att_body.encode('gb18030'))
+    assert [att_body.encode('gb18030')] == decoded
+    del decoded[:]
+    AttendanceLog.from_bytes(att_body.encode('gb18030'), keep_raw=False)
+    assert len(decoded) == len(set(decoded)) < 30
+    monkeypatch.undo()
+    monkeypatch.setattr(models, '_LINES_CHUNK_SIZE', 16)
+
+    oper_body = "\n".join([
+        "USER PIN=1\tName=李四\tPri=0\tPasswd=\tCard=\tGrp=1\tTZ=0",
+        "FP PIN=1\tFID=6\tSize=4\tValid=1\tTMP=abcd",
+        "OPLOG 4\t0\t2000-01-01 01:01:01\t0\t0\t0\t0",
+        "UNKNOWN line",
+    ])
+    for data in (oper_body.encode('gb18030'), memoryview(oper_body.encode('gb18030'))):
+        assert OperationLog.from_str(oper_body) == OperationLog.from_bytes(data)
+        # the log's own raw is dropped by from_bytes only
+        assert da.replace(OperationLog.from_str(oper_body, keep_raw=False), raw='') == \
+            OperationLog.from_bytes(data, keep_raw=False)
+
+
+def test_intern_table():
+    table = InternTable(max_size=2)
+    first = ''.join(['pin', '1'])
+    assert first is table(first)
+    assert first is table(''.join(['pin', '1']))
+    table('pin2')
+    table('pin3')  # full, starts over
+    assert 1 == len(table)
+
+    body = "pin1\t2000-01-01 01:01:01\t0\t1\t0\t0\n" \
+           "pin1\t2000-01-01 01:01:02\t0\t1\t0\t0"
+    for log in (AttendanceLog.from_str(body), AttendanceLog.from_bytes(body.encode())):
+        a, b = log.transactions
+        assert a.pin is b.pin
+        assert a.verify_code is b.verify_code
+
+    shared = InternTable()
+    a = AttendanceLog.from_bytes(body.encode(), intern=shared).transactions[0]
+    b = AttendanceLog.from_str(body, intern=shared).transactions[0]
+    assert a.pin is b.pin
+
+
+def _reference_localize(tz, value):
+    return tz.localize(value) if hasattr(tz, 'localize') else value.replace(tzinfo=tz)
+
+
+@pytest.mark.parametrize('zone', ['America/New_York', 'Australia/Lord_Howe',
+                                  'America/St_Johns', 'UTC'])
+@pytest.mark.parametrize('module', ['pytz', 'zoneinfo'])
+def test_device_timezone_matches_per_record(zone, module):
+    tz = pytz.timezone(zone) if module == 'pytz' \
+        else pytest.importorskip('zoneinfo').ZoneInfo(zone)
+    step = datetime.timedelta(minutes=29)
+    # around the 2008 transitions, St Johns switched at 00:01 back then
+    values = [datetime.datetime(2008, month, 1) + step * i
+              for month in (3, 4, 10, 11) for i in range(1500)] + [None]
+    expected = [None if v is None else _reference_localize(tz, v) for v in values]
+
+    zone_batch = DeviceTimezone(tz)
+    actual = zone_batch.localize_all(values)
+    assert expected == actual
+    assert [None if e is None else e.tzinfo for e in expected] == \
+        [None if a is None else a.tzinfo for a in actual]
+    epochs = zone_batch.utc_epoch_seconds(
+        models._local_epoch(value) for value in values)
+    assert [models.NO_EPOCH if e is None else int(e.timestamp()) for e in expected] \
+        == epochs.tolist()
+
+
+def test_log_correct_datetimes():
+    tz = pytz.timezone('Europe/Berlin')
+    body = 'pin1\t2000-07-01 12:00:00\t0\t1\t0\t0\n' \
+           'pin2\tbroken\t0\t1\t0\t0'
+    for log in (AttendanceLog.from_str(body),
+                AttendanceLog.from_str(body, columnar=True)):
+        summer, broken = log.correct_datetimes(tz)
+        assert datetime.timedelta(hours=2) == summer.utcoffset()
+        # correct_datetime attaches the pytz zone as it is, which is LMT
+        assert summer == tz.localize(log.transactions[0].server_datetime)
+        assert summer != log.transactions[0].correct_datetime(tz)
+        assert broken is None
+        assert [962445600, models.NO_EPOCH] == log.utc_epoch_seconds(tz).tolist()
+
+    operations = OperationLog.from_str('OPLOG 4\t0\t2000-01-01 12:00:00\t0\t0\t0\t0')
+    assert [946724400] == operations.utc_epoch_seconds(tz).tolist()
+    assert datetime.timedelta(hours=1) == \
+        operations.correct_datetimes(tz)[0].utcoffset()
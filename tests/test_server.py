@@ -0,0 +1,207 @@
+import asyncio
+import typing
+
+import pytest
+
+from iclockhelper.commands import CommandQueue
+from iclockhelper.journal import FSYNC_NEVER, JournalReader, JournalWriter
+from iclockhelper.models import TableEnum
+from iclockhelper.requests import CdataRequest, DeviceCmdRequest, GetRequest
+from iclockhelper.server import AdmsServer, Sink
+from iclockhelper.sync import SyncTracker
+
+_SN = 'SN_ASYNC'
+
+
+class _ListSink(Sink):
+    def __init__(self) -> None:
+        self.received = []  # type: typing.List[typing.Any]
+
+    async def on_cdata(self, request: CdataRequest) -> None:
+        self.received.append(request)
+
+    async def on_getrequest(self, request: GetRequest) -> None:
+        self.received.append(request)
+
+    async def on_devicecmd(self, request: DeviceCmdRequest) -> None:
+        self.received.append(request)
+
+
+async def _roundtrip(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        method: str,
+        target: str,
+        body: bytes = b'',
+) -> typing.Tuple[bytes, bytes]:
+    writer.write(
+        '{:s} {:s} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {:d}\r\n\r\n'.format(
+            method, target, len(body)).encode('ascii') + body)
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return status, await reader.readexactly(length)
+
+
+async def _serve(
+        sink: _ListSink,
+        queue: CommandQueue,
+) -> typing.List[typing.Tuple[bytes, bytes]]:
+    server = await AdmsServer(sinks=[sink], command_queue=queue).start(
+        '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        # all requests share one keep-alive connection
+        return [
+            await _roundtrip(
+                reader, writer, 'POST',
+                '/iclock/cdata?SN={:s}&table={:s}&Stamp=1'.format(
+                    _SN, TableEnum.attlog.value),
+                b'pin1\t2000-01-01 01:01:01\t0\t1'),
+            await _roundtrip(
+                reader, writer, 'GET',
+                '/iclock/getrequest?SN={:s}&INFO=2.4.0,3,2,10,127.0.0.1'.format(_SN)),
+            await _roundtrip(
+                reader, writer, 'POST',
+                '/iclock/devicecmd?SN={:s}'.format(_SN),
+                b'ID=1&Return=0&CMD=INFO'),
+            await _roundtrip(reader, writer, 'GET', '/unknown'),
+        ]
+    finally:
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_adms_server_keep_alive():
+    sink = _ListSink()
+    queue = CommandQueue()
+    command = queue.push(_SN, 'INFO')
+    responses = asyncio.run(_serve(sink, queue))
+
+    assert [b'HTTP/1.1 200 OK\r\n'] * 3 + [b'HTTP/1.1 404 Not Found\r\n'] == \
+        [status for status, _ in responses]
+    assert b'OK' == responses[0][1]
+    assert b'C:1:INFO\n' == responses[1][1]
+
+    cdata_req, get_req, devicecmd = sink.received
+    assert _SN == cdata_req.sn
+    assert 'pin1' == cdata_req.attendance_log.transactions[0].pin
+    assert 3 == get_req.info.user_count
+    assert '0' == devicecmd.returns[0].return_code
+    assert [] == queue.in_flight()
+    assert 1 == command.id
+
+
+def test_adms_server_journal(tmp_path):
+    path = str(tmp_path / 'cdata.journal')
+    server = AdmsServer(journal=JournalWriter(
+        path, fsync=FSYNC_NEVER, commit_interval=3600))
+    query = 'SN={:s}&table=ATTLOG&Stamp=1'.format(_SN)
+    body = b'pin1\t2000-01-01 01:01:01\t0\t1'
+
+    async def upload_and_shutdown():
+        assert 'OK' == await server.cdata('POST', query, body)
+        await server.shutdown()
+
+    asyncio.run(upload_and_shutdown())
+    with JournalReader(path) as reader:
+        assert 1 == len(reader)
+        assert (query, body) == (reader[0].query_string, reader[0].body)
+
+
+class _FailingSink(Sink):
+    async def on_getrequest(self, request: GetRequest) -> None:
+        raise RuntimeError('sink down')
+
+
+async def _serve_errors() -> typing.List[typing.Tuple[bytes, bytes]]:
+    server = await AdmsServer(sinks=[_FailingSink()]).start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        return [
+            await _roundtrip(
+                reader, writer, 'POST',
+                '/iclock/cdata?SN={:s}&table=OPERLOG&OpStamp=1'.format(_SN),
+                b'OPLOG 4\t0'),
+            await _roundtrip(
+                reader, writer, 'POST',
+                '/iclock/cdata?SN={:s}&table=ATTPHOTO&PIN=garbage'.format(_SN),
+                b'PIN=garbage\nCMD=uploadphoto\0data'),
+            await _roundtrip(
+                reader, writer, 'GET', '/iclock/getrequest?SN={:s}'.format(_SN)),
+        ]
+    finally:
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+
+async def _serve_oversized() -> typing.List[bytes]:
+    server = await AdmsServer().start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    statuses = []
+    try:
+        for request in (
+                # over the StreamReader limit of 64 KiB
+                b'GET /iclock/getrequest?SN=' + b'1' * 70000 + b' HTTP/1.1\r\n\r\n',
+                b'GET /iclock/getrequest HTTP/1.1\r\nX: ' + b'1' * 70000 + b'\r\n\r\n',
+                b'POST /iclock/cdata HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+        ):
+            # these close the connection, a new one each
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            statuses.append(await reader.readline())
+            writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    return statuses
+
+
+def test_adms_server_errors_reply():
+    # the connection stays usable after every error
+    assert [b'HTTP/1.1 400 Bad Request\r\n'] * 2 + [
+        b'HTTP/1.1 500 Internal Server Error\r\n'] == [
+        status for status, _ in asyncio.run(_serve_errors())]
+
+
+class _FlakySink(_ListSink):
+    async def on_cdata(self, request: CdataRequest) -> None:
+        if not self.received:
+            self.received.append(None)
+            raise RuntimeError('sink down')
+        await super().on_cdata(request)
+
+
+def test_adms_server_sync_redelivers_after_sink_error():
+    sink = _FlakySink()
+    server = AdmsServer(sinks=[sink], sync_tracker=SyncTracker())
+    query = 'SN={:s}&table=ATTLOG&Stamp=1'.format(_SN)
+    body = b'pin1\t2000-01-01 01:01:01\t0\t1'
+
+    async def upload_twice():
+        with pytest.raises(RuntimeError):
+            await server.cdata('POST', query, body)
+        # the device retries the same upload, then re-sends it once more
+        assert 'OK' == await server.cdata('POST', query, body)
+        assert 'OK' == await server.cdata('POST', query, body)
+
+    asyncio.run(upload_twice())
+    assert [1, 0] == [len(r.attendance_log.transactions) for r in sink.received[1:]]
+    assert '1' == server.sync_tracker.stamp(_SN, TableEnum.attlog)
+
+
+def test_adms_server_oversized_and_negative_length():
+    assert [
+        b'HTTP/1.1 400 Bad Request\r\n',
+        b'HTTP/1.1 431 Request Header Fields Too Large\r\n',
+        b'HTTP/1.1 400 Bad Request\r\n',
+    ] == asyncio.run(_serve_oversized())
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import pytest
+
+from iclockhelper.store import MemorySyncStore, SqliteSyncStore, SyncStore
+
+
+def _check_store(store):
+    assert store.get_stamp('SN1', 'ATTLOG') is None
+    store.set_stamp('SN1', 'ATTLOG', '10')
+    assert '10' == store.get_stamp('SN1', 'ATTLOG')
+    assert [True, True, False] == store.unseen('SN1', [1, 2, 1])
+    assert [True, True, False] == store.add_seen('SN1', [1, 2, 1])
+    assert [False, True, False] == store.unseen('SN1', [2, 3, 3])
+    assert [False, True] == store.add_seen('SN1', [2, 3])
+    assert [True] == store.add_seen('SN2', [1])
+
+
+def test_memory_store():
+    _check_store(MemorySyncStore())
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / 'sync.db')
+    store = SqliteSyncStore(path, commit_every=1000, commit_interval=3600)
+    _check_store(store)
+    store.close()
+
+    store = SqliteSyncStore(path)
+    assert '10' == store.get_stamp('SN1', 'ATTLOG')
+    assert [False, False, True] == store.add_seen('SN1', [1, 3, 4])
+    assert 'wal' == store._conn.execute('PRAGMA journal_mode').fetchone()[0]
+    store.close()
+
+
+def test_sqlite_store_evicts_oldest(tmp_path):
+    path = str(tmp_path / 'sync.db')
+    store = SqliteSyncStore(path, max_seen=3)
+    assert [True] * 4 == store.add_seen('SN1', [1, 2, 3, 4])
+    assert [True] == store.add_seen('SN2', [1])
+    store.close()
+
+    store = SqliteSyncStore(path, max_seen=3)
+    # 1 was evicted, the other device keeps its keys
+    assert [True, False, False] == store.add_seen('SN1', [1, 4, 3])
+    assert [True] == store.add_seen('SN1', [2])
+    assert [False] == store.add_seen('SN2', [1])
+    assert 3 == store._conn.execute(
+        "SELECT COUNT(*) FROM seen WHERE sn = 'SN1'").fetchone()[0]
+    store.close()
+
+
+def test_sqlite_store_commits_when_idle(tmp_path):
+    path = str(tmp_path / 'sync.db')
+    store = SqliteSyncStore(path, commit_every=1000, commit_interval=0.01)
+    store.set_stamp('SN1', 'ATTLOG', '10')
+    reader = sqlite3.connect(path)
+    deadline = time.monotonic() + 5
+    stamps = []
+    while not stamps and time.monotonic() < deadline:
+        time.sleep(0.01)
+        stamps = reader.execute('SELECT stamp FROM stamps').fetchall()
+    reader.close()
+    store.close()
+    assert [('10',)] == stamps
+
+
+def test_sync_store_is_abstract():
+    with pytest.raises(TypeError):
+        SyncStore()
@@ -0,0 +1,88 @@
+from iclockhelper.models import TableEnum
+from iclockhelper.requests import CdataRequest
+from iclockhelper.store import DedupIndex
+from iclockhelper.sync import SyncTracker
+
+from .common import DeviceRequestBuilder
+
+_SN = 'SN_SYNC'
+
+_builder = DeviceRequestBuilder(
+    sn=_SN,
+    iclock_host='http://localhost',
+    fw_version='2.4.0',
+)
+
+
+def _attlog(stamp: str, *lines: str) -> CdataRequest:
+    return CdataRequest.from_req(_builder.cdatarequest(
+        query={'table': TableEnum.attlog.value, 'Stamp': stamp},
+        body='\n'.join(lines).encode('ascii'),
+    ))
+
+
+def test_tracker_drops_reuploaded_transactions():
+    tracker = SyncTracker()
+    first = tracker.process(_attlog(
+        '10',
+        'pin1\t2000-01-01 01:01:01\t0\t1',
+        'pin2\t2000-01-01 01:01:02\t0\t1',
+    ))
+    assert 2 == len(first.attendance_log.transactions)
+
+    # device rebooted and re-sent an overlapping range
+    second = tracker.process(_attlog(
+        '11',
+        'pin2\t2000-01-01 01:01:02\t0\t1',
+        'pin2\t2000-01-01 01:01:02\t1\t1',
+    ))
+    assert [('pin2', '1')] == [
+        (t.pin, t.check_type) for t in second.attendance_log.transactions]
+    assert '11' == tracker.stamp(_SN, TableEnum.attlog)
+
+
+def test_tracker_options_reply():
+    tracker = SyncTracker(options={'Delay': '5'})
+    tracker.acknowledge(CdataRequest.from_req(_builder.cdatarequest(
+        query={'table': TableEnum.operlog.value, 'OpStamp': '42'},
+        body=b'OPLOG 4\t0\t2000-01-01 01:01:01\t0\t0\t0\t0',
+    )))
+    options_req = CdataRequest.from_req(_builder.cdatarequest(
+        query={'options': 'all', 'pushver': '2.4.0'}))
+    assert 'all' == options_req.options
+
+    reply = tracker.options_reply(options_req.sn).split('\n')
+    assert 'GET OPTION FROM: {:s}'.format(_SN) == reply[0]
+    assert ['Stamp=0', 'OpStamp=42', 'PhotoStamp=0'] == reply[1:4]
+    assert 'Delay=5' in reply
+
+
+def test_dedup_index_is_bounded():
+    index = DedupIndex(max_entries=2)
+    assert index.add(1) and index.add(2) and not index.add(1)
+    assert index.add(3)
+    assert 1 not in index
+    assert 2 == len(index)
+
+
+def test_tracker_filter_does_not_mark_seen():
+    tracker = SyncTracker()
+    req = _attlog(
+        '10',
+        'pin1\t2000-01-01 01:01:01\t0\t1',
+        'pin1\t2000-01-01 01:01:01\t0\t1',
+    )
+    # duplicates within one upload are dropped right away
+    assert 1 == len(tracker.filter(req).attendance_log.transactions)
+    assert 1 == len(tracker.filter(req).attendance_log.transactions)
+    tracker.acknowledge(tracker.filter(req))
+    assert [] == tracker.filter(req).attendance_log.transactions
+
+
+def test_dedup_index_evicts_whole_blocks():
+    index = DedupIndex(max_entries=80)
+    for key in range(100):
+        assert index.add(key)
+    assert 80 == len(index)
+    assert 19 not in index and 20 in index and 99 in index
+    assert not index.add(50)